@@ -0,0 +1,208 @@
+"""Calendar analytics over a period, computed on columnar NumPy arrays.
+
+load_columns() reads a period's events once into EventColumns: parallel arrays
+of start, end and calendar, location and attendee codes. Every aggregate below
+is a few vectorized operations over those arrays rather than a Python loop over
+event dicts, so multi-year ranges of thousands of events are summarized in
+milliseconds; the load is the only per-event Python work. Results come back as
+plain Python values, so callers never handle arrays.
+"""
+from datetime import datetime
+
+import numpy as np
+
+from event_store import event_bounds
+
+SECONDS_PER_HOUR = 3600
+SECONDS_PER_DAY = 24 * SECONDS_PER_HOUR
+# 1970-01-01 was a Thursday: (epoch day + EPOCH_WEEKDAY) % 7 gives Monday = 0
+EPOCH_WEEKDAY = 3
+# Trends over longer periods than this are reported per month instead of per week
+WEEKLY_TREND_MAX_DAYS = 120
+
+
+class EventColumns:
+    """Timed events of one period as parallel arrays, clipped to the period.
+
+    Times are local epoch seconds: UTC epoch seconds plus the zone's offset at
+    each event's start, so day and hour arithmetic lands on local days and hours.
+    calendar and location index into calendars and locations (-1 when an event
+    has no location); attendee_event and attendee pair each attendance with the
+    row of its event.
+    """
+    __slots__ = ('start', 'end', 'calendar', 'location', 'attendee_event', 'attendee',
+                 'calendars', 'locations', 'attendees', 'range_start', 'range_end')
+
+    def __len__(self):
+        return len(self.start)
+
+    @property
+    def hours(self):
+        return (self.end - self.start) / SECONDS_PER_HOUR
+
+
+def load_columns(events, start_date, end_date, tz, exclude_attendees=()):
+    """EventColumns for the events in [start_date, end_date] (whole local days in tz).
+
+    All-day events are days off and holidays rather than meetings, and events
+    marked free do not occupy time, so both are left out. An event shared onto
+    several of the user's calendars is counted once. Attendees in
+    exclude_attendees (the user and their calendars) and those who declined are
+    left out of the attendee columns.
+    """
+    range_start = tz.localize(datetime.combine(start_date, datetime.min.time()))
+    range_end = tz.localize(datetime.combine(end_date, datetime.max.time()))
+    starts, ends, offsets, calendar_codes, location_codes = [], [], [], [], []
+    attendee_rows, attendee_codes = [], []
+    calendars, locations, attendees, display_names = {}, {}, {}, {}
+    seen = set()
+    for event in events:
+        if 'dateTime' not in event.get('start', {}) or event.get('transparency') == 'transparent' or event.get('status') == 'cancelled':
+            continue
+        if event.get('id') in seen:
+            continue
+        seen.add(event.get('id'))
+        start, end = event_bounds(event)
+        row = len(starts)
+        starts.append(start.timestamp())
+        ends.append(end.timestamp())
+        offsets.append(start.astimezone(tz).utcoffset().total_seconds())
+        calendar_codes.append(calendars.setdefault(event.get('calendarId', 'primary'), len(calendars)))
+        location = event.get('location', '').strip()
+        location_codes.append(locations.setdefault(location, len(locations)) if location else -1)
+        for attendee in event.get('attendees', []):
+            email = attendee.get('email')
+            if not email or email in exclude_attendees or attendee.get('responseStatus') == 'declined':
+                continue
+            attendee_rows.append(row)
+            attendee_codes.append(attendees.setdefault(email, len(attendees)))
+            if attendee.get('displayName'):
+                display_names[email] = attendee['displayName']
+
+    columns = EventColumns()
+    lower, upper = range_start.timestamp(), range_end.timestamp()
+    offset = np.array(offsets, dtype=np.float64)
+    columns.start = np.clip(np.array(starts, dtype=np.float64), lower, upper) + offset
+    columns.end = np.clip(np.array(ends, dtype=np.float64), lower, upper) + offset
+    columns.calendar = np.array(calendar_codes, dtype=np.int64)
+    columns.location = np.array(location_codes, dtype=np.int64)
+    columns.attendee_event = np.array(attendee_rows, dtype=np.int64)
+    columns.attendee = np.array(attendee_codes, dtype=np.int64)
+    columns.calendars = list(calendars)
+    columns.locations = list(locations)
+    columns.attendees = [display_names.get(email, email) for email in attendees]
+    columns.range_start = lower + range_start.utcoffset().total_seconds()
+    columns.range_end = upper + range_end.utcoffset().total_seconds()
+    return columns
+
+
+def meeting_hours(columns):
+    """Total length of all meetings; overlapping meetings each count in full."""
+    return float(columns.hours.sum())
+
+
+def busy_hours(columns):
+    """Hours in which at least one meeting was running; overlaps count once."""
+    if not len(columns):
+        return 0.0
+    order = np.argsort(columns.start, kind='stable')
+    start, end = columns.start[order], columns.end[order]
+    reach = np.maximum.accumulate(end)
+    # A busy block starts wherever a meeting begins after everything before it has ended
+    first = np.flatnonzero(np.r_[True, start[1:] > reach[:-1]])
+    last = np.r_[first[1:] - 1, len(start) - 1]
+    return float((reach[last] - start[first]).sum() / SECONDS_PER_HOUR)
+
+
+def _ramp_sum(points, edges):
+    # sum(max(edge - point, 0)) over sorted points, for every edge at once
+    count = np.searchsorted(points, edges)
+    prefix = np.r_[0.0, np.cumsum(points)]
+    return edges * count - prefix[count]
+
+
+def hourly_load(columns):
+    """(first hour, loads): meeting hours in each local clock hour of the period.
+
+    Hours are numbered from the epoch in local time. Time spent in meetings
+    before t is sum(max(t - start, 0)) - sum(max(t - end, 0)), which sorted
+    prefix sums give for every hour boundary in one pass, so meetings are split
+    exactly across the hours they cover. Overlapping meetings add up.
+    """
+    first = int(columns.range_start // SECONDS_PER_HOUR)
+    last = int(np.ceil(columns.range_end / SECONDS_PER_HOUR))
+    edges = np.arange(first, last + 1, dtype=np.float64) * SECONDS_PER_HOUR
+    covered = _ramp_sum(np.sort(columns.start), edges) - _ramp_sum(np.sort(columns.end), edges)
+    return first, np.diff(covered) / SECONDS_PER_HOUR
+
+
+def weekday_hour_heatmap(columns):
+    """7 x 24 nested list of meeting hours by local weekday (Monday first) and hour of day."""
+    first, load = hourly_load(columns)
+    hours = np.arange(first, first + len(load))
+    weekdays = (hours // 24 + EPOCH_WEEKDAY) % 7
+    return np.bincount(weekdays * 24 + hours % 24, weights=load, minlength=7 * 24).reshape(7, 24).tolist()
+
+
+def weekday_load(columns):
+    """Average meeting hours on each weekday of the period, Monday first."""
+    totals = np.array(weekday_hour_heatmap(columns)).sum(axis=1)
+    days = np.arange(int(columns.range_start // SECONDS_PER_DAY), int(columns.range_end // SECONDS_PER_DAY) + 1)
+    occurrences = np.bincount((days + EPOCH_WEEKDAY) % 7, minlength=7)
+    return (totals / np.maximum(occurrences, 1)).tolist()
+
+
+def _top(codes, names, hours, limit):
+    counts = np.bincount(codes, minlength=len(names))
+    totals = np.bincount(codes, weights=hours, minlength=len(names))
+    order = np.lexsort((-totals, -counts))[:limit]
+    return [(names[code], int(counts[code]), float(totals[code])) for code in order if counts[code]]
+
+
+def top_attendees(columns, limit=5):
+    """(attendee, meetings, hours) for the people met most often."""
+    return _top(columns.attendee, columns.attendees, columns.hours[columns.attendee_event], limit)
+
+
+def top_locations(columns, limit=5):
+    """(location, meetings, hours) for the most used locations."""
+    has_location = columns.location >= 0
+    return _top(columns.location[has_location], columns.locations, columns.hours[has_location], limit)
+
+
+def calendar_hours(columns):
+    """(calendar id, meeting hours) per calendar, most hours first."""
+    totals = np.bincount(columns.calendar, weights=columns.hours, minlength=len(columns.calendars))
+    return [(columns.calendars[code], float(totals[code])) for code in np.argsort(-totals, kind='stable')]
+
+
+def trend(columns, until=None):
+    """(unit, [(period start date, hours)], fitted change in hours per unit).
+
+    The unit is 'week' (starting Monday) for periods up to WEEKLY_TREND_MAX_DAYS
+    and 'month' beyond that. Weeks or months without meetings count as zero, so
+    until (a date) ends the series early, leaving out weeks or months that are
+    still to come.
+    """
+    first_day = int(columns.range_start // SECONDS_PER_DAY)
+    last_day = int(columns.range_end // SECONDS_PER_DAY)
+    if until is not None:
+        last_day = min(last_day, int(np.datetime64(until, 'D').astype(np.int64)))
+    days = (columns.start // SECONDS_PER_DAY).astype(np.int64)
+    past = days <= last_day
+    days, hours = days[past], columns.hours[past]
+    if last_day - first_day < WEEKLY_TREND_MAX_DAYS:
+        unit = 'week'
+        origin = first_day - (first_day + EPOCH_WEEKDAY) % 7
+        buckets = (days - origin) // 7
+        count = (last_day - origin) // 7 + 1
+        labels = (origin + 7 * np.arange(count)).astype('datetime64[D]')
+    else:
+        unit = 'month'
+        origin = np.datetime64(first_day, 'D').astype('datetime64[M]').astype(np.int64)
+        buckets = days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64) - origin
+        count = int(np.datetime64(last_day, 'D').astype('datetime64[M]').astype(np.int64) - origin) + 1
+        labels = (origin + np.arange(count)).astype('datetime64[M]').astype('datetime64[D]')
+    totals = np.bincount(buckets, weights=hours, minlength=count)
+    slope = float(np.polyfit(np.arange(count), totals, 1)[0]) if count > 1 else 0.0
+    return unit, list(zip(labels.tolist(), totals.tolist())), slope
@@ -0,0 +1,963 @@
+"""Calendar assistant core: intent dispatch, the agents, and the Calendar and LLM helpers.
+
+Nothing here depends on a UI. State lives in the session returned by
+current_session(), so the same code serves the Streamlit app and the API server.
+Heavy client libraries (openai, googleapiclient, dateutil) and the NumPy-backed
+analytics module are imported inside the functions that use them, so importing
+this module stays cheap.
+"""
+import json
+import time
+from datetime import datetime, timedelta
+import logging
+import pytz
+from collections import Counter
+import heapq
+from calendar_client import get_cached_service
+from event_store import get_event_store, event_bounds, EVENT_LIST_FIELDS, STREAM_PAGE_SIZE, SYNC_PAGE_SIZE, MAX_BATCH_SIZE
+from intervals import merge_intervals, free_windows, daily_windows
+from temporal import recognize_query, resolve_date, search_terms
+from event_search import EventSearchIndex, tokenize
+from conversation import ConversationContext, compact_event, MAX_PROMPT_EVENTS
+from llm_cache import get_response_cache, make_key, normalize_query
+from tracing import span, traced, turn
+from session_state import current_session, init_session
+
+logger = logging.getLogger(__name__)
+
+SCOPES = ['https://www.googleapis.com/auth/calendar.events', 'https://www.googleapis.com/auth/calendar.readonly']
+
+# Set the time zone to GMT+8 (Malaysia)
+malaysia_tz = pytz.timezone('Asia/Kuala_Lumpur')
+
+# Free-slot search only suggests times inside these hours
+WORKING_HOURS = (9, 18)
+
+# Upper bound on events created or changed by a single request
+MAX_BULK_EVENTS = 100
+WEEKDAY_NAMES = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+# Analytics questions without a stated period cover this many days up to today
+ANALYTICS_DEFAULT_DAYS = 90
+ANALYTICS_METRICS = ["overview", "busy_hours", "busiest_day", "heatmap", "top_attendees", "top_locations", "trend"]
+
+# Single structured-output schema shared by intent dispatch and every agent
+QUERY_EXTRACTION_FUNCTION = {
+    "name": "extract_calendar_query",
+    "description": "Classify the user's calendar request and extract its details.",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "intent": {
+                "type": "string",
+                "enum": ["create_event", "modify_events", "retrieve_events", "get_event_details", "find_free_slots", "analyze_events", "general_query"],
+                "description": "create_event also covers several or repeating new events; modify_events moves or deletes existing events in bulk; analyze_events answers questions about meeting time, busiest days, frequent attendees or locations, and trends over a period",
+            },
+            "title": {"type": "string", "description": "Title of the event to create"},
+            "date": {"type": "string", "description": "Date as YYYY-MM-DD, 'today' or 'tomorrow'"},
+            "end_date": {"type": "string", "description": "Last date (YYYY-MM-DD) when the user asks about a multi-day range"},
+            "time": {"type": "string", "description": "Start time as HH:MM (24-hour)"},
+            "duration_minutes": {"type": "integer", "description": "Event length, or the free-slot length being searched for"},
+            "description": {"type": "string", "description": "Description of the event to create"},
+            "event_summary": {"type": "string", "description": "Title or keywords of an existing event the user asks about"},
+            "range": {"type": "string", "enum": ["day", "week"], "description": "Span to search for free slots"},
+            "events": {
+                "type": "array",
+                "description": "Several distinct events to create in one request, each with its own details",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "title": {"type": "string"},
+                        "date": {"type": "string"},
+                        "time": {"type": "string"},
+                        "duration_minutes": {"type": "integer"},
+                        "description": {"type": "string"},
+                    },
+                },
+            },
+            "weekdays": {
+                "type": "array",
+                "description": "Days a new event repeats on from date until end_date, or days whose events modify_events changes",
+                "items": {"type": "string", "enum": WEEKDAY_NAMES},
+            },
+            "action": {"type": "string", "enum": ["move", "delete"], "description": "What modify_events does to the matching events"},
+            "shift_minutes": {"type": "integer", "description": "How far modify_events moves matching events; negative is earlier"},
+            "metric": {"type": "string", "enum": ANALYTICS_METRICS, "description": "What analyze_events reports on the period from date to end_date, which covers whole periods: 'this month' runs from its first to its last day; overview when unsure"},
+        },
+        "required": ["intent"],
+    },
+}
+
+def get_current_time():
+    return datetime.now(malaysia_tz)
+
+def calendar_service(credentials):
+    return get_cached_service(credentials, SCOPES)
+
+def traced_execute(stage, request):
+    with span(stage) as record:
+        response = request.execute()
+        record['response_bytes'] = len(json.dumps(response))
+    return response
+
+def load_calendar_list(service):
+    # One calendarList call per session gives both the user's identity and the calendars they follow
+    session = current_session()
+    calendars = traced_execute('calendar.calendarList.list', service.calendarList().list(minAccessRole='reader', maxResults=250)).get('items', [])
+    calendar_ids = ['primary']
+    for calendar in calendars:
+        if calendar.get('primary'):
+            session.user_id = calendar['id']
+        elif calendar.get('selected'):
+            calendar_ids.append(calendar['id'])
+    session.calendar_ids = calendar_ids
+
+def get_user_id(service):
+    session = current_session()
+    if 'user_id' not in session:
+        load_calendar_list(service)
+    return session.user_id
+
+def get_calendar_ids(service):
+    session = current_session()
+    if 'calendar_ids' not in session:
+        load_calendar_list(service)
+    return session.calendar_ids
+
+def synced_store(service):
+    store = get_event_store()
+    user_id = get_user_id(service)
+    calendar_ids = get_calendar_ids(service)
+    try:
+        with span('store.sync', calendars=len(calendar_ids)):
+            store.sync(service, user_id, calendar_ids)
+    except Exception as e:
+        logger.error(f"Error syncing event store: {str(e)}")
+    return store, user_id, calendar_ids
+
+def paginate_events(service, request, response, calendar_id):
+    # Yields one page at a time; the next page is only requested once this one is consumed
+    while response is not None:
+        for event in response.get('items', []):
+            event['calendarId'] = calendar_id
+            yield event
+        request = service.events().list_next(request, response)
+        response = traced_execute('calendar.events.list', request) if request else None
+
+def iter_events(service, calendar_ids, start_datetime, end_datetime, page_size=STREAM_PAGE_SIZE):
+    # First pages of every calendar arrive in one batch; later pages stream in lazily
+    requests = [service.events().list(calendarId=calendar_id,
+                                      timeMin=start_datetime.isoformat(),
+                                      timeMax=end_datetime.isoformat(),
+                                      singleEvents=True,
+                                      orderBy='startTime',
+                                      maxResults=page_size,
+                                      fields=EVENT_LIST_FIELDS) for calendar_id in calendar_ids]
+    first_pages = {}
+
+    def collect(request_id, response, exception):
+        if exception is not None:
+            logger.error(f"Error listing events for {calendar_ids[int(request_id)]}: {str(exception)}")
+        else:
+            first_pages[int(request_id)] = response
+
+    for chunk_start in range(0, len(requests), MAX_BATCH_SIZE):
+        batch = service.new_batch_http_request(callback=collect)
+        positions = range(chunk_start, min(chunk_start + MAX_BATCH_SIZE, len(requests)))
+        for position in positions:
+            batch.add(requests[position], request_id=str(position))
+        with span('calendar.batch.events.list', calls=len(positions)):
+            batch.execute()
+
+    streams = [paginate_events(service, requests[position], first_pages[position], calendar_ids[position])
+               for position in sorted(first_pages)]
+    return heapq.merge(*streams, key=lambda event: event_bounds(event)[0])
+
+def remember_events(events, sink):
+    # Pass events through unchanged while keeping compact records of the first few for the conversation context
+    for event in events:
+        if len(sink) < MAX_PROMPT_EVENTS:
+            sink.append(compact_event(event))
+        yield event
+
+def list_events(service, start_datetime, end_datetime, page_size=STREAM_PAGE_SIZE):
+    # Answer from the local event store; only ranges older than its sync window hit the API.
+    store, user_id, calendar_ids = synced_store(service)
+    if store.covers(user_id, start_datetime, calendar_ids):
+        return store.events_between(user_id, start_datetime, end_datetime, calendar_ids)
+    return iter_events(service, calendar_ids, start_datetime, end_datetime, page_size)
+
+def parse_date_time(date_str, time_str=None, context_date=None):
+    now = get_current_time()
+    date = resolve_date(date_str, now.date())
+    if date is None or time_str:
+        from dateutil import parser
+    if date is None:
+        try:
+            date = parser.parse(date_str).date()
+        except:
+            if isinstance(context_date, str):
+                context_date = datetime.fromisoformat(context_date).date()
+            date = context_date if context_date else now.date()
+
+    if time_str:
+        try:
+            time = parser.parse(time_str).time()
+        except:
+            time = now.time()
+    else:
+        time = now.time()
+
+    return malaysia_tz.localize(datetime.combine(date, time))
+
+def parse_event_details(extraction, context):
+    try:
+        # Set defaults and parse date/time
+        now = get_current_time()
+        event_details = {
+            'title': extraction.get('title', ""),
+            'duration_minutes': int(extraction.get('duration_minutes', 60)),
+            'description': extraction.get('description', ""),
+        }
+
+        start_datetime = parse_date_time(
+            extraction.get('date', context.get('last_mentioned_date', now.strftime('%Y-%m-%d'))),
+            extraction.get('time'),
+            context.get('last_mentioned_date')
+        )
+
+        event_details['start_datetime'] = start_datetime
+        event_details['end_datetime'] = start_datetime + timedelta(minutes=event_details['duration_minutes'])
+
+        logger.info(f"Parsed event details: {event_details}")
+        return event_details
+    except Exception as e:
+        logger.error(f"Error in parse_event_details: {str(e)}")
+        return None
+
+def prompt_for_title(extraction):
+    session = current_session()
+    session.waiting_for_title = True
+    session.temp_event_details = extraction
+    return "What is this event about? Please provide a title for the event."
+
+def check_for_clash(service, start_time, end_time):
+    store, user_id, calendar_ids = synced_store(service)
+    if store.covers(user_id, start_time, calendar_ids):
+        events = store.overlapping(user_id, start_time, end_time, calendar_ids)
+    else:
+        events = iter_events(service, calendar_ids, start_time, end_time)
+    # Events marked free to attend, like holidays and birthdays on followed calendars, never clash
+    return [event for event in events if event.get('transparency') != 'transparent']
+
+def get_busy_intervals(service, start_datetime, end_datetime):
+    store, user_id, calendar_ids = synced_store(service)
+    if store.covers(user_id, start_datetime, calendar_ids):
+        events = store.overlapping(user_id, start_datetime, end_datetime, calendar_ids)
+        return [event_bounds(event) for event in events if event.get('transparency') != 'transparent']
+
+    # Outside the synced window, load the whole range in one freebusy call
+    freebusy = traced_execute('calendar.freebusy.query', service.freebusy().query(body={
+        'timeMin': start_datetime.isoformat(),
+        'timeMax': end_datetime.isoformat(),
+        'timeZone': 'Asia/Kuala_Lumpur',
+        'items': [{'id': calendar_id} for calendar_id in calendar_ids],
+    }))
+    busy = [block for calendar in freebusy['calendars'].values() for block in calendar.get('busy', [])]
+    return [(datetime.fromisoformat(block['start'].replace('Z', '+00:00')),
+             datetime.fromisoformat(block['end'].replace('Z', '+00:00'))) for block in busy]
+
+def find_free_slots(service, start_date, days, duration_minutes):
+    windows = daily_windows(malaysia_tz, start_date, days, WORKING_HOURS[0], WORKING_HOURS[1], not_before=get_current_time())
+    if not windows:
+        return []
+    busy = merge_intervals(get_busy_intervals(service, windows[0][0], windows[-1][1]))
+    duration = timedelta(minutes=duration_minutes)
+    slots = []
+    for window_start, window_end in windows:
+        slots.extend(free_windows(busy, window_start, window_end, duration))
+    return slots
+
+def format_free_slots(slots, duration_minutes):
+    if not slots:
+        return f"No free slots of {duration_minutes} minutes found."
+    slot_list = []
+    for start, end in slots:
+        start = start.astimezone(malaysia_tz)
+        end = end.astimezone(malaysia_tz)
+        slot_list.append(f"{start.strftime('%a %Y-%m-%d')}: {start.strftime('%I:%M %p')} - {end.strftime('%I:%M %p')}")
+    return f"Free slots of at least {duration_minutes} minutes:\n" + "\n".join(slot_list)
+
+def create_event(service, event_details):
+    from googleapiclient.errors import HttpError
+    try:
+        created_event = traced_execute('calendar.events.insert', service.events().insert(calendarId='primary', body=event_body(event_details)))
+        get_event_store().upsert_event(get_user_id(service), created_event)
+        
+        response = f"Event created successfully!\n"
+        response += f"Title: {event_details['title']}\n"
+        response += f"Date: {event_details['start_datetime'].strftime('%Y-%m-%d')}\n"
+        response += f"Time: {event_details['start_datetime'].strftime('%I:%M %p')} - {event_details['end_datetime'].strftime('%I:%M %p')}\n"
+        response += f"Duration: {event_details['duration_minutes']} minutes\n"
+        response += f"Description: {event_details['description']}\n"
+        response += f"Calendar link: {created_event.get('htmlLink')}"
+        
+        return response
+    except HttpError as e:
+        error_details = json.loads(e.content.decode())
+        return f"An error occurred while creating the event: {error_details}"
+    except Exception as e:
+        return f"An unexpected error occurred while creating the event: {str(e)}"
+
+def event_body(event_details):
+    return {
+        'summary': event_details['title'],
+        'description': event_details['description'],
+        'start': {
+            'dateTime': event_details['start_datetime'].isoformat(),
+            'timeZone': 'Asia/Kuala_Lumpur',
+        },
+        'end': {
+            'dateTime': event_details['end_datetime'].isoformat(),
+            'timeZone': 'Asia/Kuala_Lumpur',
+        },
+    }
+
+def execute_batch(service, requests):
+    # Runs requests through batch HTTP calls; returns (response, exception) per request, in order
+    results = [(None, None)] * len(requests)
+
+    def collect(request_id, response, exception):
+        results[int(request_id)] = (response, exception)
+
+    for chunk_start in range(0, len(requests), MAX_BATCH_SIZE):
+        batch = service.new_batch_http_request(callback=collect)
+        positions = range(chunk_start, min(chunk_start + MAX_BATCH_SIZE, len(requests)))
+        for position in positions:
+            batch.add(requests[position], request_id=str(position))
+        with span('calendar.batch.write', calls=len(positions)):
+            batch.execute()
+    return results
+
+def format_batch_results(verb, lines, failures):
+    response = f"{verb} {len(lines) - failures} of {len(lines)} events:\n" + "\n".join(lines)
+    if failures:
+        response += f"\n{failures} failed; you can retry those individually."
+    return response
+
+def create_events(service, event_details_list):
+    requests = [service.events().insert(calendarId='primary', body=event_body(details)) for details in event_details_list]
+    store, user_id = get_event_store(), get_user_id(service)
+    lines, failures = [], 0
+    for details, (created_event, exception) in zip(event_details_list, execute_batch(service, requests)):
+        when = f"{details['start_datetime'].strftime('%Y-%m-%d %I:%M %p')} - {details['end_datetime'].strftime('%I:%M %p')}"
+        if exception is not None:
+            failures += 1
+            lines.append(f"✗ {details['title']} ({when}): {str(exception)}")
+        else:
+            store.upsert_event(user_id, created_event)
+            lines.append(f"✓ {details['title']} ({when})")
+    return format_batch_results("Created", lines, failures)
+
+def move_events(service, events, shift_minutes):
+    shift = timedelta(minutes=shift_minutes)
+    requests = []
+    for event in events:
+        start, end = event_bounds(event)
+        requests.append(service.events().patch(calendarId='primary', eventId=event['id'], body={
+            'start': {'dateTime': (start + shift).astimezone(malaysia_tz).isoformat(), 'timeZone': 'Asia/Kuala_Lumpur'},
+            'end': {'dateTime': (end + shift).astimezone(malaysia_tz).isoformat(), 'timeZone': 'Asia/Kuala_Lumpur'},
+        }))
+    store, user_id = get_event_store(), get_user_id(service)
+    lines, failures = [], 0
+    for event, (updated_event, exception) in zip(events, execute_batch(service, requests)):
+        if exception is not None:
+            failures += 1
+            lines.append(f"✗ {event['summary']}: {str(exception)}")
+        else:
+            store.upsert_event(user_id, updated_event)
+            lines.append(f"✓ {format_event(updated_event)[2:]}")
+    return format_batch_results("Moved", lines, failures)
+
+def delete_events(service, records):
+    requests = [service.events().delete(calendarId='primary', eventId=record.id) for record in records]
+    store, user_id = get_event_store(), get_user_id(service)
+    lines, failures = [], 0
+    for record, (_, exception) in zip(records, execute_batch(service, requests)):
+        if exception is not None:
+            failures += 1
+            lines.append(f"✗ {record.summary}: {str(exception)}")
+        else:
+            store.delete_event(user_id, record.id)
+            lines.append(f"✓ {format_record(record)[2:]}")
+    return format_batch_results("Deleted", lines, failures)
+
+def modify_event(service, event_id, updates):
+    from googleapiclient.errors import HttpError
+    try:
+        event = traced_execute('calendar.events.get', service.events().get(calendarId='primary', eventId=event_id))
+        for key, value in updates.items():
+            if key in event:
+                event[key] = value
+        updated_event = traced_execute('calendar.events.update', service.events().update(calendarId='primary', eventId=event_id, body=event))
+        get_event_store().upsert_event(get_user_id(service), updated_event)
+        return f"Event updated successfully. New details:\n{format_event(updated_event)}"
+    except HttpError as e:
+        error_details = json.loads(e.content.decode())
+        return f"An error occurred while modifying the event: {error_details}"
+    except Exception as e:
+        return f"An unexpected error occurred while modifying the event: {str(e)}"
+
+def get_events_for_date(service, date):
+    try:
+        start_datetime = malaysia_tz.localize(datetime.combine(date, datetime.min.time()))
+        end_datetime = malaysia_tz.localize(datetime.combine(date, datetime.max.time()))
+        
+        return list_events(service, start_datetime, end_datetime)
+    except Exception as e:
+        logger.error(f"Error in get_events_for_date: {str(e)}")
+        return []
+
+def format_event(event):
+    return format_record(compact_event(event))
+
+def format_start(start, with_date=False):
+    # All-day events start on a bare date, which has no time of day to convert
+    if 'T' not in start:
+        return f"on {start} (all-day event)" if with_date else "(all-day event)"
+    start_time = datetime.fromisoformat(start).astimezone(malaysia_tz)
+    if with_date:
+        return f"on {start_time.strftime('%Y-%m-%d')} at {start_time.strftime('%I:%M %p')}"
+    return f"at {start_time.strftime('%I:%M %p')}"
+
+def format_record(record):
+    return f"- {record.summary} {format_start(record.start)}"
+
+@traced('format_events')
+def format_events(events):
+    event_list = []
+    locations = Counter()
+    for event in events:
+        start = event['start'].get('dateTime', event['start'].get('date'))
+        event_str = f"{event['summary']} {format_start(start)}"
+        if 'location' in event:
+            event_str += f" ({event['location']})"
+            locations[event['location']] += 1
+        event_list.append(event_str)
+
+    if not event_list:
+        return "No events scheduled."
+    response = "Events:\n" + "\n".join(event_list)
+    if locations:
+        response += "\n\nLocations summary:\n" + "\n".join(f"{loc}: {count}" for loc, count in locations.most_common())
+    return response
+
+def get_event_details(service, event_summary, date=None, end_date=None):
+    try:
+        if date:
+            start_datetime = malaysia_tz.localize(datetime.combine(date, datetime.min.time()))
+            end_datetime = malaysia_tz.localize(datetime.combine(end_date or date, datetime.max.time()))
+        else:
+            start_datetime = end_datetime = None
+
+        store, user_id, calendar_ids = synced_store(service)
+        if store.covers(user_id, start_datetime or get_current_time(), calendar_ids):
+            matches = store.search(user_id, event_summary, calendar_ids, start_datetime=start_datetime, end_datetime=end_datetime)
+        else:
+            # Outside the synced window: rank a live listing of the range instead
+            if not start_datetime:
+                start_datetime = get_current_time()
+                end_datetime = start_datetime + timedelta(days=30)  # Look for events in the next 30 days
+            events = {(event['calendarId'], event['id']): event for event in iter_events(service, calendar_ids, start_datetime, end_datetime)}
+            index = EventSearchIndex((event, event_bounds(event)[0].timestamp()) for event in events.values())
+            matches = [(score, events[key]) for score, key in index.search(event_summary)]
+
+        logger.info(f"Event search for '{event_summary}': {[(round(score, 2), event.get('summary')) for score, event in matches]}")
+        return matches[0][1] if matches else None
+    except Exception as e:
+        logger.error(f"Error in get_event_details: {str(e)}")
+        return None
+
+def chat_completion(cache_key, parse=None, stage='llm', **kwargs):
+    # Every OpenAI call goes through here; a response is cached only once it parsed cleanly
+    cache = get_response_cache()
+    with span(stage, model=kwargs.get('model'), request_bytes=len(json.dumps(kwargs['messages']))) as record:
+        message = cache.get(cache_key)
+        record['cache_hit'] = message is not None
+        if message is None:
+            import openai
+            response = openai.ChatCompletion.create(**kwargs)
+            record['prompt_tokens'] = response['usage']['prompt_tokens']
+            record['completion_tokens'] = response['usage']['completion_tokens']
+            message = json.loads(json.dumps(response.choices[0].message))
+            record['response_bytes'] = len(json.dumps(message))
+            result = parse(message) if parse else message
+            cache.set(cache_key, message)
+            return result
+    return parse(message) if parse else message
+
+def stream_chat_completion(cache_key, stage='llm', **kwargs):
+    # Yields reply text as it arrives; the full reply is cached once the stream completes
+    cache = get_response_cache()
+    with span(stage, model=kwargs.get('model'), request_bytes=len(json.dumps(kwargs['messages'])), stream=True) as record:
+        start = time.perf_counter()
+        message = cache.get(cache_key)
+        record['cache_hit'] = message is not None
+        if message is not None:
+            yield message['content']
+            return
+        import openai
+        chunks = []
+        for chunk in openai.ChatCompletion.create(stream=True, **kwargs):
+            token = chunk.choices[0].delta.get('content')
+            if token:
+                if not chunks:
+                    record['first_token_ms'] = (time.perf_counter() - start) * 1000
+                chunks.append(token)
+                yield token
+        # Streamed completions carry no usage block; count chunks as an approximation
+        record['completion_tokens'] = len(chunks)
+        record['response_bytes'] = len(''.join(chunks).encode())
+        cache.set(cache_key, {'role': 'assistant', 'content': ''.join(chunks)})
+
+def validate_value(name, value, spec):
+    if spec['type'] == 'integer':
+        return int(value)
+    if spec['type'] == 'array':
+        if not isinstance(value, list):
+            raise ValueError(f"{name} is not a list")
+        items = []
+        for item in value:
+            try:
+                items.append(validate_value(name, item, spec['items']))
+            except (TypeError, ValueError):
+                logger.warning(f"Dropping invalid {name} item: {item!r}")
+        return items
+    if spec['type'] == 'object':
+        if not isinstance(value, dict):
+            raise ValueError(f"{name} is not an object")
+        return validate_extraction(value, spec)
+    value = str(value)
+    if 'enum' in spec and value not in spec['enum']:
+        raise ValueError(f"{value!r} is not one of {spec['enum']}")
+    return value
+
+def validate_extraction(arguments, schema=QUERY_EXTRACTION_FUNCTION['parameters']):
+    # Keep only fields that match the schema, coercing numbers the model returned as strings
+    result = {}
+    for name, spec in schema['properties'].items():
+        value = arguments.get(name)
+        if value in (None, "", []):
+            continue
+        try:
+            result[name] = validate_value(name, value, spec)
+        except (TypeError, ValueError):
+            logger.warning(f"Dropping invalid {name}: {value!r}")
+    for name in schema.get('required', []):
+        if name not in result:
+            raise ValueError(f"Missing required field '{name}'")
+    return result
+
+def dispatch_query(query, context):
+    # One function-calling request returns the intent together with every slot the agents need
+    try:
+        today = get_current_time().strftime('%Y-%m-%d (%A)')
+        # The cache is shared by every session, so the key covers everything the prompt carries:
+        # a hit is only possible when the whole conversation context matches too
+        cache_key = make_key('dispatch_query', normalize_query(query), today, context)
+        result = chat_completion(
+            cache_key,
+            stage='llm.dispatch_query',
+            parse=lambda message: validate_extraction(json.loads(message['function_call']['arguments'])),
+            model="gpt-3.5-turbo",
+            messages=[
+                {"role": "system", "content": f"You are an intelligent calendar assistant. Today is {today} in Asia/Kuala_Lumpur. Determine the user's intent and extract every relevant detail by calling extract_calendar_query. Pay close attention to the context from previous queries."},
+                {"role": "user", "content": f"Context: {json.dumps(context)}\nCurrent query: {query}"}
+            ],
+            functions=[QUERY_EXTRACTION_FUNCTION],
+            function_call={"name": QUERY_EXTRACTION_FUNCTION['name']}
+        )
+        logger.info(f"Dispatch result: {result}")
+        return result
+    except Exception as e:
+        logger.error(f"Error in dispatch_query: {str(e)}")
+        return {"intent": "general_query"}
+
+def expand_event_specs(extraction):
+    # A request may list several events, or one event repeating on some weekdays until end_date
+    base = {key: extraction[key] for key in ('title', 'date', 'time', 'duration_minutes', 'description') if key in extraction}
+    specs = [dict(base, **spec) for spec in extraction.get('events', [])] or [base]
+    if extraction.get('weekdays') and extraction.get('end_date'):
+        first = parse_date_time(base.get('date', 'today')).date()
+        last = parse_date_time(extraction['end_date'], context_date=first).date()
+        weekdays = {WEEKDAY_NAMES.index(day) for day in extraction['weekdays']}
+        specs = [dict(spec, date=(first + timedelta(days=offset)).isoformat())
+                 for offset in range((last - first).days + 1)
+                 if (first + timedelta(days=offset)).weekday() in weekdays
+                 for spec in specs]
+    return specs[:MAX_BULK_EVENTS]
+
+def check_for_clashes(service, event_details_list):
+    # One sync, then an index lookup per new event plus a sweep for overlaps among the new events themselves
+    store, user_id, calendar_ids = synced_store(service)
+    clashes = []
+    for details in event_details_list:
+        if store.covers(user_id, details['start_datetime'], calendar_ids):
+            found = store.overlapping(user_id, details['start_datetime'], details['end_datetime'], calendar_ids)
+        else:
+            found = list(iter_events(service, calendar_ids, details['start_datetime'], details['end_datetime']))
+        clashes.extend((details, event.get('summary', '(No title)'), event_bounds(event)[0])
+                       for event in found if event.get('transparency') != 'transparent')
+    ordered = sorted(event_details_list, key=lambda details: details['start_datetime'])
+    for previous, current in zip(ordered, ordered[1:]):
+        if current['start_datetime'] < previous['end_datetime']:
+            clashes.append((current, previous['title'], previous['start_datetime']))
+    return clashes
+
+def create_event_agent(service, extraction, context):
+    session = current_session()
+    specs = expand_event_specs(extraction)
+    if not specs:
+        return f"No days between {extraction.get('date', 'today')} and {extraction['end_date']} fall on {', '.join(day.capitalize() for day in extraction['weekdays'])}, so nothing was created."
+    if len(specs) > 1:
+        return create_events_agent(service, specs, extraction, context)
+
+    event_details = parse_event_details(specs[0], context)
+    if not event_details:
+        return "Please provide event details."
+
+    if not event_details['title']:
+        return prompt_for_title(specs[0])
+
+    clashing_events = check_for_clash(service, event_details['start_datetime'], event_details['end_datetime'])
+    if clashing_events:
+        clash_info = "\n".join(format_event(event) for event in clashing_events)
+        session.pending_event = event_details
+        session.waiting_for_clash_confirmation = True
+        return f"Clashing events:\n{clash_info}\nCreate anyway? (Yes/No)"
+
+    return create_event(service, event_details)
+
+def create_events_agent(service, specs, extraction, context):
+    session = current_session()
+    event_details_list = [parse_event_details(spec, context) for spec in specs]
+    if not all(event_details_list):
+        return "Please provide event details."
+
+    if not all(details['title'] for details in event_details_list):
+        return prompt_for_title(extraction)
+
+    clashes = check_for_clashes(service, event_details_list)
+    if clashes:
+        clash_info = "\n".join(
+            f"{details['title']} ({details['start_datetime'].strftime('%Y-%m-%d %I:%M %p')}) clashes with {title} ({start.astimezone(malaysia_tz).strftime('%I:%M %p')})"
+            for details, title, start in clashes
+        )
+        session.pending_event = event_details_list
+        session.waiting_for_clash_confirmation = True
+        return f"Clashing events:\n{clash_info}\nCreate all {len(event_details_list)} events anyway? (Yes/No)"
+
+    return create_events(service, event_details_list)
+
+def find_events_to_modify(service, extraction):
+    first = parse_date_time(extraction.get('date', 'today')).date()
+    if extraction.get('end_date'):
+        last = parse_date_time(extraction['end_date'], context_date=first).date()
+    else:
+        last = first + timedelta(days=6 if extraction.get('weekdays') else 0)
+    start_datetime = malaysia_tz.localize(datetime.combine(first, datetime.min.time()))
+    end_datetime = malaysia_tz.localize(datetime.combine(last, datetime.max.time()))
+
+    # Only the user's own calendar is changed; timed events only, all-day ones are left alone
+    events = [event for event in list_events(service, start_datetime, end_datetime)
+              if event.get('calendarId', 'primary') == 'primary' and 'dateTime' in event['start']]
+    if extraction.get('weekdays'):
+        weekdays = {WEEKDAY_NAMES.index(day) for day in extraction['weekdays']}
+        events = [event for event in events if event_bounds(event)[0].astimezone(malaysia_tz).weekday() in weekdays]
+    if extraction.get('event_summary'):
+        # Bulk changes need every word of the filter in the title; fuzzy search would sweep in similar events
+        terms = set(tokenize(extraction['event_summary']))
+        events = [event for event in events if terms <= set(tokenize(event.get('summary', '')))]
+    return events[:MAX_BULK_EVENTS]
+
+def modify_events_agent(service, extraction):
+    session = current_session()
+    action = extraction.get('action', 'move')
+    shift_minutes = extraction.get('shift_minutes')
+    if action == 'move' and not shift_minutes:
+        return "How far should I move those events?"
+
+    events = find_events_to_modify(service, extraction)
+    if not events:
+        return "No matching events found."
+
+    # Bulk changes are confirmed first; only the fields needed to carry them out wait in the session
+    listing = "\n".join(format_event(event) for event in events)
+    session.waiting_for_bulk_confirmation = True
+    if action == 'delete':
+        session.pending_bulk_delete = [compact_event(event) for event in events]
+        return f"This will delete {len(events)} events:\n{listing}\nProceed? (Yes/No)"
+    session.pending_bulk_move = ([{key: event[key] for key in ('id', 'summary', 'start', 'end') if key in event} for event in events], shift_minutes)
+    direction = 'later' if shift_minutes > 0 else 'earlier'
+    return f"This will move {len(events)} events {abs(shift_minutes)} minutes {direction}:\n{listing}\nProceed? (Yes/No)"
+
+def analyze_events_agent(service, extraction, context):
+    # NumPy is only loaded once someone asks an analytics question
+    from analytics import load_columns
+
+    today = get_current_time().date()
+    if extraction.get('date'):
+        start_date = parse_date_time(extraction['date'], context_date=context.get('last_mentioned_date')).date()
+        end_date = parse_date_time(extraction['end_date'], context_date=start_date).date() if extraction.get('end_date') else max(start_date, today)
+    else:
+        start_date, end_date = today - timedelta(days=ANALYTICS_DEFAULT_DAYS - 1), today
+    if end_date < start_date:
+        start_date, end_date = end_date, start_date
+    if extraction.get('metric') == 'trend' and start_date <= today < end_date:
+        # Weeks and months that have not happened yet would drag the trend down
+        end_date = today
+
+    exclude = {get_user_id(service), *get_calendar_ids(service)}
+    with span('analytics.load') as record:
+        # The whole range is needed before anything can be reported, so fetch it in the largest pages
+        events = get_events_for_period(service, start_date, end_date, page_size=SYNC_PAGE_SIZE)
+        columns = load_columns(events, start_date, end_date, malaysia_tz, exclude)
+        record['events'] = len(columns)
+    return format_analytics(columns, extraction.get('metric', 'overview'), start_date, end_date)
+
+HEATMAP_SHADES = ' .:-=+*#%@'
+
+@traced('format_analytics')
+def format_analytics(columns, metric, start_date, end_date):
+    from analytics import (busy_hours, calendar_hours, meeting_hours, top_attendees, top_locations,
+                           trend, weekday_hour_heatmap, weekday_load)
+
+    period = f"{start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}"
+    if not len(columns):
+        return f"No meetings found from {period}."
+    lines = [f"Meetings from {period}: {len(columns)}"]
+
+    if metric in ('overview', 'busy_hours'):
+        lines.append(f"Time in meetings: {busy_hours(columns):.1f} hours "
+                     f"({meeting_hours(columns):.1f} hours counting overlapping meetings separately)")
+        by_calendar = calendar_hours(columns)
+        if metric == 'busy_hours' and len(by_calendar) > 1:
+            lines.extend(f"- {calendar_id}: {hours:.1f} hours" for calendar_id, hours in by_calendar)
+
+    if metric in ('overview', 'busiest_day'):
+        load = weekday_load(columns)
+        ranked = sorted(range(7), key=lambda day: -load[day])
+        lines.append(f"Busiest day of the week: {WEEKDAY_NAMES[ranked[0]].capitalize()} "
+                     f"({load[ranked[0]]:.1f} hours of meetings on an average {WEEKDAY_NAMES[ranked[0]].capitalize()})")
+        if metric == 'busiest_day':
+            lines.extend(f"- {WEEKDAY_NAMES[day].capitalize()}: {load[day]:.1f} hours" for day in ranked)
+            by_hour = [sum(hours) for hours in zip(*weekday_hour_heatmap(columns))]
+            peak = max(range(24), key=lambda hour: by_hour[hour])
+            lines.append(f"Busiest hour: {peak:02d}:00-{(peak + 1) % 24:02d}:00")
+
+    if metric == 'heatmap':
+        heatmap = weekday_hour_heatmap(columns)
+        peak = max(max(row) for row in heatmap) or 1
+        lines.append("Meeting load by weekday and hour (darker is busier):")
+        lines.append("```")
+        lines.append("     " + "".join(f"{hour:<6d}" for hour in range(0, 24, 6)).rstrip())
+        for day, row in enumerate(heatmap):
+            shades = "".join(HEATMAP_SHADES[min(int(value / peak * len(HEATMAP_SHADES)), len(HEATMAP_SHADES) - 1)] for value in row)
+            lines.append(f"{WEEKDAY_NAMES[day][:3].capitalize()}  {shades}")
+        lines.append("```")
+
+    if metric in ('overview', 'top_attendees'):
+        people = top_attendees(columns, 3 if metric == 'overview' else 10)
+        if people:
+            lines.append("People you meet most:")
+            lines.extend(f"- {name}: {count} meetings, {hours:.1f} hours" for name, count, hours in people)
+        elif metric == 'top_attendees':
+            lines.append("None of these meetings had other attendees.")
+
+    if metric in ('overview', 'top_locations'):
+        places = top_locations(columns, 3 if metric == 'overview' else 10)
+        if places:
+            lines.append("Most used locations:")
+            lines.extend(f"- {name}: {count} meetings, {hours:.1f} hours" for name, count, hours in places)
+        elif metric == 'top_locations':
+            lines.append("None of these meetings had a location.")
+
+    if metric in ('overview', 'trend'):
+        today = get_current_time().date()
+        unit, series, slope = trend(columns, until=today if start_date <= today else None)
+        direction = 'rising' if slope > 0.05 else 'falling' if slope < -0.05 else 'steady'
+        lines.append(f"Trend: {direction} ({slope:+.1f} hours per {unit})")
+        if metric == 'trend':
+            lines.extend(f"- {'Week of ' if unit == 'week' else ''}{start.strftime('%Y-%m-%d' if unit == 'week' else '%B %Y')}: {hours:.1f} hours"
+                         for start, hours in series)
+
+    return "\n".join(lines)
+
+def format_event_details(event):
+    start = event['start'].get('dateTime', event['start'].get('date'))
+    details = f"{event['summary']} {format_start(start, with_date=True)}"
+    if 'location' in event:
+        details += f"\nLocation: {event['location']}"
+    if 'description' in event:
+        details += f"\nDescription: {event['description']}"
+    return details
+
+def process_query(service, query):
+    session = current_session()
+    try:
+        context = session.get('context', {})
+        if 'conversation' not in session:
+            session.conversation = ConversationContext()
+        prompt_context = session.conversation.prompt_context(context, session.get('messages', []))
+
+        if 'waiting_for_title' in session and session.waiting_for_title:
+            extraction = session.temp_event_details
+            extraction['title'] = query
+            session.waiting_for_title = False
+            del session.temp_event_details
+            return create_event_agent(service, extraction, context)
+
+        if 'waiting_for_clash_confirmation' in session and session.waiting_for_clash_confirmation:
+            if query.lower() in ['yes', 'y']:
+                session.waiting_for_clash_confirmation = False
+                event_details = session.pending_event
+                del session.pending_event
+                if isinstance(event_details, list):
+                    return create_events(service, event_details)
+                return create_event(service, event_details)
+            elif query.lower() in ['no', 'n']:
+                session.waiting_for_clash_confirmation = False
+                del session.pending_event
+                return "Event creation cancelled."
+            else:
+                return "Please respond with Yes or No."
+
+        if session.get('waiting_for_bulk_confirmation'):
+            if query.lower() not in ['yes', 'y', 'no', 'n']:
+                return "Please respond with Yes or No."
+            session.waiting_for_bulk_confirmation = False
+            if 'pending_bulk_move' in session:
+                events, shift_minutes = session.pop('pending_bulk_move')
+                if query.lower() in ['yes', 'y']:
+                    return move_events(service, events, shift_minutes)
+                return "Nothing was moved."
+            events = session.pop('pending_bulk_delete')
+            if query.lower() in ['yes', 'y']:
+                return delete_events(service, events)
+            return "Nothing was deleted."
+
+        # Queries the local recognizer fully understands skip the LLM round trip
+        with span('fast_path') as record:
+            dispatch_result = recognize_query(query, get_current_time())
+            record['matched'] = dispatch_result is not None
+        if dispatch_result:
+            logger.info(f"Fast path dispatch result: {dispatch_result}")
+        else:
+            dispatch_result = dispatch_query(query, prompt_context)
+
+        intent = dispatch_result.get('intent', 'general_query')
+        date_str = dispatch_result.get('date')
+
+        if intent == 'create_event':
+            return create_event_agent(service, dispatch_result, context)
+        elif intent == 'modify_events':
+            return modify_events_agent(service, dispatch_result)
+        elif intent == 'retrieve_events':
+            date = parse_date_time(date_str or 'today', context_date=context.get('last_mentioned_date')).date()
+            context['last_retrieved_date'] = date.isoformat()
+            if dispatch_result.get('end_date'):
+                end_date = parse_date_time(dispatch_result['end_date'], context_date=date).date()
+                context['last_retrieved_events'] = []
+                events = remember_events(get_events_for_period(service, date, end_date), context['last_retrieved_events'])
+                return f"Events for {date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}:\n" + format_events(events)
+            context['last_retrieved_events'] = []
+            events = remember_events(get_events_for_date(service, date), context['last_retrieved_events'])
+            return f"Events for {date.strftime('%Y-%m-%d')}:\n" + format_events(events)
+        elif intent == 'get_event_details':
+            event_summary = dispatch_result.get('event_summary')
+            end_date_str = dispatch_result.get('end_date')
+            if not event_summary and context.get('last_retrieved_events'):
+                # Search on what is left of the query once its temporal phrases are taken out
+                slots, event_summary = search_terms(query, get_current_time().date())
+                if not date_str and 'date' in slots:
+                    date_str = slots['date'].isoformat()
+                    end_date_str = slots['end_date'].isoformat() if 'end_date' in slots else None
+
+            if event_summary:
+                date = parse_date_time(date_str, context_date=context.get('last_retrieved_date')).date() if date_str else None
+                end_date = parse_date_time(end_date_str, context_date=date).date() if date and end_date_str else None
+                event = get_event_details(service, event_summary, date, end_date)
+                if event:
+                    return format_event_details(event)
+                else:
+                    return f"No event found matching '{event_summary}'."
+            else:
+                return "Which event are you asking about?"
+        elif intent == 'find_free_slots':
+            start_date = parse_date_time(date_str, context_date=context.get('last_mentioned_date')).date() if date_str else get_current_time().date()
+            if dispatch_result.get('end_date'):
+                days = (parse_date_time(dispatch_result['end_date'], context_date=start_date).date() - start_date).days + 1
+            else:
+                days = 7 if dispatch_result.get('range') == 'week' else 1
+            duration_minutes = int(dispatch_result.get('duration_minutes') or 60)
+            slots = find_free_slots(service, start_date, days, duration_minutes)
+            return format_free_slots(slots, duration_minutes)
+        elif intent == 'analyze_events':
+            return analyze_events_agent(service, dispatch_result, context)
+        elif intent == 'small_talk':
+            return dispatch_result['reply']
+        else:
+            return general_query_agent(query)
+
+    except Exception as e:
+        logger.error(f"Error in process_query: {str(e)}")
+        return f"Error processing request: {str(e)}"
+
+
+def get_events_for_period(service, start_date, end_date, page_size=STREAM_PAGE_SIZE):
+    try:
+        start_datetime = malaysia_tz.localize(datetime.combine(start_date, datetime.min.time()))
+        end_datetime = malaysia_tz.localize(datetime.combine(end_date, datetime.max.time()))
+        
+        return list_events(service, start_datetime, end_datetime, page_size)
+    except Exception as e:
+        logger.error(f"Error in get_events_for_period: {str(e)}")
+        return []
+
+def general_query_agent(query):
+    try:
+        yield from stream_chat_completion(
+            make_key('general_query_agent', normalize_query(query), get_current_time().strftime('%Y-%m-%d')),
+            stage='llm.general_query_agent',
+            model="gpt-3.5-turbo",
+            messages=[
+                {"role": "system", "content": "You are a helpful calendar assistant. Provide a friendly and informative response to the user's query."},
+                {"role": "user", "content": query}
+            ]
+        )
+    except Exception as e:
+        logger.error(f"Error in general_query_agent: {str(e)}")
+        yield "I'm sorry, I encountered an error while processing your request."
+
+def run_turn(service, query, on_chunk=None):
+    """One chat turn in the current session: records the exchange and returns the reply.
+
+    on_chunk, if given, receives the reply as it is produced, in one or more pieces.
+    """
+    session = current_session()
+    init_session(session)
+    session.messages.append({"role": "user", "content": query})
+    with turn(session.trace_stats, label=query[:80]):
+        response = process_query(service, query)
+        # Agents return either a finished string or a generator of text chunks
+        chunks = [response] if isinstance(response, str) else response
+        text = ""
+        for chunk in chunks:
+            text += chunk
+            if on_chunk:
+                on_chunk(chunk)
+    session.messages.append({"role": "assistant", "content": text})
+
+    context = session.context
+    context['last_query'] = query
+    context['last_response'] = text
+    return text
@@ -0,0 +1,375 @@
+"""Offline end-to-end benchmark for the calendar assistant.
+
+Drives process_query through scripted multi-turn conversations against the
+local Calendar and OpenAI fakes in fake_services.py, so no credentials or
+network access are needed. For every turn it reports latency, Calendar round
+trips and API calls, LLM calls, prompt tokens and session memory. Pass --baseline with the JSON
+from an earlier --output run to fail on regressions: any extra round trip or
+LLM call, or prompt tokens growing past --token-tolerance.
+
+Every run also imports assistant.py in a fresh interpreter and fails if that
+takes longer than --import-budget-ms or loads a client library that should be
+deferred to first use.
+
+With --users N, each scenario instead runs as N concurrent sessions against the
+HTTP API in server.py, reporting throughput and latency percentiles per turn.
+
+    python bench.py --events 2000 --calendar-latency-ms 80 --output bench.json
+    python bench.py --users 200 --scenario retrieve_and_details
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import pytz
+
+# The app modules read their storage paths at import, so point them at a scratch directory first
+WORKDIR = tempfile.mkdtemp(prefix='calendar-bench-')
+os.environ.setdefault('EVENT_STORE_PATH', os.path.join(WORKDIR, 'event_store.sqlite3'))
+os.environ.setdefault('SESSION_HISTORY_PATH', os.path.join(WORKDIR, 'session_history.sqlite3'))
+os.environ.setdefault('LLM_CACHE_BACKEND', 'memory')
+
+import aiohttp
+import openai
+from aiohttp import web
+
+from assistant import calendar_service, get_current_time, run_turn
+from calendar_client import use_transport_factory
+from fake_services import FakeCalendar, FakeOpenAI, generate_events
+from import_budget import IMPORT_BUDGET_MS, import_problems, measure_import
+from llm_cache import get_response_cache
+from server import make_app
+from session_state import Session, init_session, session_memory_bytes, use_session
+from tracing import percentile, process_stats
+
+malaysia_tz = pytz.timezone('Asia/Kuala_Lumpur')
+
+# Every session signs in as the one fake account; the token stays valid for the whole run so it is never refreshed
+BENCH_CREDENTIALS = {'token': 'bench', 'refresh_token': 'bench', 'client_id': 'bench', 'client_secret': 'bench',
+                     'expiry': (datetime.utcnow() + timedelta(days=1)).strftime('%Y-%m-%dT%H:%M:%SZ')}
+HOLIDAY_CALENDAR = 'en.malaysia#holiday@group.v.calendar.google.com'
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+
+def at(day, hour, minute=0, minutes=60):
+    start = malaysia_tz.localize(datetime(day.year, day.month, day.day, hour, minute))
+    return {'start': {'dateTime': start.isoformat()}, 'end': {'dateTime': (start + timedelta(minutes=minutes)).isoformat()}}
+
+
+def all_day(day, days=1):
+    return {'start': {'date': day.isoformat()}, 'end': {'date': (day + timedelta(days=days)).isoformat()}}
+
+
+def next_weekday(today, weekday):
+    return today + timedelta(days=(weekday - today.weekday()) % 7 or 7)
+
+
+# Each scenario: fixture events on the user's calendar, optional all-day events on a followed holiday
+# calendar, then turns of (query, canned function-call arguments or reply text, or None when the query
+# should be handled without the LLM)
+def create_with_clash(today):
+    tomorrow = today + timedelta(days=1)
+    friday = next_weekday(today, 4)
+    return {
+        'fixtures': [dict(summary='Design sync', **at(tomorrow, 15)), dict(summary='Team offsite', **all_day(tomorrow))],
+        # Holidays are free time, so they never count as clashes
+        'holidays': [dict(summary='Public holiday', transparency='transparent', **all_day(tomorrow))],
+        'turns': [
+            ("Schedule a design review tomorrow at 3pm for 1 hour", None),
+            ("yes", None),
+            ("Book lunch with Aisha on Friday at 1pm", None),
+            ("Also add a vendor call on Friday at 4pm, 30 minutes, about the Q3 contract",
+             {'intent': 'create_event', 'title': 'Vendor call', 'date': friday.isoformat(), 'time': '16:00',
+              'duration_minutes': 30, 'description': 'Q3 contract'}),
+            ("Add gym every Tuesday and Thursday at 7am until the end of next month",
+             {'intent': 'create_event', 'title': 'Gym', 'date': today.isoformat(), 'time': '07:00',
+              'end_date': (today.replace(day=1) + timedelta(days=62)).replace(day=1).isoformat(),
+              'weekdays': ['tuesday', 'thursday'], 'duration_minutes': 60}),
+            # Repeating requests that land on one day, or none, and a one-item event list
+            (f"Add an early run at 7am every {WEEKDAYS[(today.weekday() + 4) % 7]} over the coming week",
+             {'intent': 'create_event', 'title': 'Early run', 'date': (today + timedelta(days=1)).isoformat(), 'time': '07:00',
+              'end_date': (today + timedelta(days=7)).isoformat(), 'weekdays': [WEEKDAYS[(today.weekday() + 4) % 7]]}),
+            (f"Add a planning block at 9am every {WEEKDAYS[(today.weekday() + 4) % 7]} over the next two days",
+             {'intent': 'create_event', 'title': 'Planning', 'date': (today + timedelta(days=1)).isoformat(), 'time': '09:00',
+              'end_date': (today + timedelta(days=2)).isoformat(), 'weekdays': [WEEKDAYS[(today.weekday() + 4) % 7]]}),
+            ("add standup with Siti",
+             {'intent': 'create_event', 'events': [{'title': 'Standup with Siti', 'date': friday.isoformat(), 'time': '11:00'}]}),
+        ],
+    }
+
+
+def retrieve_and_details(today):
+    tomorrow = today + timedelta(days=1)
+    next_monday = next_weekday(today, 0)
+    return {
+        'fixtures': [dict(summary='Quarterly review with Aisha', location='Board room',
+                          description='Numbers for Q3 and hiring plan', **at(tomorrow, 10))],
+        'turns': [
+            ("What is on tomorrow?", None),
+            ("Tell me more about the quarterly review",
+             {'intent': 'get_event_details', 'event_summary': 'quarterly review', 'date': tomorrow.isoformat()}),
+            ("what about next week?",
+             {'intent': 'retrieve_events', 'date': next_monday.isoformat(), 'end_date': (next_monday + timedelta(days=6)).isoformat()}),
+            ("show my events this week", None),
+            ("What should I prepare for a quarterly review?",
+             "Bring last quarter's numbers, open risks and the hiring plan."),
+        ],
+    }
+
+
+def free_slots(today):
+    next_monday = next_weekday(today, 0)
+    return {
+        'fixtures': [],
+        'turns': [
+            ("When am I free tomorrow for 30 minutes?", None),
+            ("find a free hour next week",
+             {'intent': 'find_free_slots', 'date': next_monday.isoformat(), 'range': 'week', 'duration_minutes': 60}),
+        ],
+    }
+
+
+def long_conversation(today):
+    # Prompt tokens and session memory should level off once older turns are folded and spilled
+    turns = []
+    for offset in range(1, 13):
+        day = today + timedelta(days=offset)
+        turns.append((f"What do I have on {day.strftime('%B %d')}, and anything I should move?",
+                      {'intent': 'retrieve_events', 'date': day.isoformat()}))
+        turns.append((f"Any tips for getting through day {offset} of this stretch?",
+                      "Block focus time early and keep meetings short."))
+    return {'fixtures': [], 'turns': turns}
+
+
+def analytics(today):
+    # Three years of meetings, mostly older than the event store's sync window, so most ranges are read from the API
+    history = generate_events(1500, ['primary'], malaysia_tz, seed=7, first_day=-3 * 365, last_day=0)
+    return {
+        'fixtures': [event for _, event in history],
+        'turns': [
+            ("How many hours of meetings did I have this quarter?", None),
+            ("Which day of the week is busiest?", None),
+            ("Who did I meet with most over the past three years?", None),
+            ("How has my meeting load changed over the last couple of years?",
+             {'intent': 'analyze_events', 'metric': 'trend', 'date': (today - timedelta(days=2 * 365)).isoformat(),
+              'end_date': today.isoformat()}),
+        ],
+    }
+
+
+SCENARIOS = {
+    'create_with_clash': create_with_clash,
+    'retrieve_and_details': retrieve_and_details,
+    'free_slots': free_slots,
+    'long_conversation': long_conversation,
+    'analytics': analytics,
+}
+
+
+def prepare(calendar, llm, name, script, args, run):
+    # Fresh account, canned LLM answers and an empty response cache for one run of a scenario
+    calendar_ids = [f"team-{number}@group.calendar.google.com" for number in range(args.calendars - 1)]
+    user_id = f"{name}-{run}@bench.local"
+    events = generate_events(args.events, [user_id, *calendar_ids], malaysia_tz, seed=run)
+    events += [(user_id, event) for event in script['fixtures']]
+    if script.get('holidays'):
+        calendar_ids.append(HOLIDAY_CALENDAR)
+        events += [(HOLIDAY_CALENDAR, event) for event in script['holidays']]
+    calendar.reset(user_id, calendar_ids, events)
+    llm.reset(
+        extractions={query: answer for query, answer in script['turns'] if isinstance(answer, dict)},
+        replies={query: answer for query, answer in script['turns'] if isinstance(answer, str)},
+    )
+    get_response_cache().backend.clear()
+
+
+def run_scenario(calendar, llm, name, script, args, run):
+    prepare(calendar, llm, name, script, args, run)
+    session = Session()
+    init_session(session)
+    service = calendar_service(BENCH_CREDENTIALS)
+
+    results = []
+    for number, (query, _) in enumerate(script['turns'], 1):
+        before = (calendar.round_trips, calendar.calls, len(llm.requests))
+        start = time.perf_counter()
+        with use_session(session):
+            text = run_turn(service, query)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        llm_requests = llm.requests[before[2]:]
+        results.append({
+            'turn': number,
+            'query': query,
+            'latency_ms': round(elapsed_ms, 1),
+            'calendar_round_trips': calendar.round_trips - before[0],
+            'calendar_calls': calendar.calls - before[1],
+            'llm_calls': len(llm_requests),
+            'prompt_tokens': sum(request['prompt_tokens'] for request in llm_requests),
+            'response_chars': len(text),
+            'session_kb': round(session_memory_bytes(session)['total'] / 1024, 1),
+            'error': text.startswith('Error processing request'),
+        })
+    return results
+
+
+async def run_load(calendar, llm, name, script, args):
+    """args.users sessions play the script at once through the HTTP API; returns per-turn latencies."""
+    prepare(calendar, llm, name, script, args, 0)
+    # Every session is the same account, so all turns share one cached service the way same-user sessions do in production
+    runner = web.AppRunner(make_app(workers=args.workers))
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    base_url = f"http://{host}:{port}"
+
+    async def user(client, number):
+        async with client.post(f"{base_url}/sessions", json={'credentials': BENCH_CREDENTIALS}) as response:
+            session_id = (await response.json())['session_id']
+        latencies, errors = [], 0
+        for query, _ in script['turns']:
+            start = time.perf_counter()
+            async with client.post(f"{base_url}/sessions/{session_id}/messages", json={'query': query}) as response:
+                body = await response.json()
+            latencies.append((time.perf_counter() - start) * 1000)
+            errors += response.status != 200 or body['reply'].startswith('Error processing request')
+        return latencies, errors
+
+    try:
+        connector = aiohttp.TCPConnector(limit=0)
+        async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=600)) as client:
+            start = time.perf_counter()
+            users = await asyncio.gather(*(user(client, number) for number in range(args.users)))
+            wall_seconds = time.perf_counter() - start
+    finally:
+        await runner.cleanup()
+    return users, wall_seconds
+
+
+def print_load_report(name, script, users, wall_seconds, args):
+    turns = len(script['turns']) * len(users)
+    print(f"\n== {name}: {args.users} concurrent sessions, {args.workers} workers")
+    print(f"{turns} turns in {wall_seconds:.1f}s ({turns / wall_seconds:.1f} turns/s), "
+          f"{sum(errors for _, errors in users)} errors")
+    print(f"{'turn':>4} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}  query")
+    for number, (query, _) in enumerate(script['turns']):
+        ordered = sorted(latencies[number] for latencies, _ in users)
+        print(f"{number + 1:>4} {percentile(ordered, 0.5):>8.1f} {percentile(ordered, 0.95):>8.1f} {ordered[-1]:>8.1f}  {query[:60]}")
+
+
+def check_imports(budget_ms):
+    elapsed_ms, loaded = measure_import('assistant')
+    print(f"\n== imports\nassistant: {elapsed_ms:.1f} ms (budget {budget_ms:.0f} ms)")
+    return import_problems(elapsed_ms, loaded, budget_ms)
+
+
+def aggregate(runs):
+    # Counts are deterministic; latency is the median over repeated runs
+    merged = []
+    for turns in zip(*runs):
+        row = dict(turns[-1])
+        row['latency_ms'] = round(statistics.median(turn['latency_ms'] for turn in turns), 1)
+        merged.append(row)
+    return merged
+
+
+def print_report(results, stage_summary):
+    header = f"{'turn':>4} {'latency ms':>10} {'rt':>3} {'api':>4} {'llm':>3} {'prompt tok':>10} {'session kb':>10}  query"
+    for name, turns in results.items():
+        print(f"\n== {name}")
+        print(header)
+        for row in turns:
+            flag = ' !' if row['error'] else ''
+            print(f"{row['turn']:>4} {row['latency_ms']:>10.1f} {row['calendar_round_trips']:>3} {row['calendar_calls']:>4} "
+                  f"{row['llm_calls']:>3} {row['prompt_tokens']:>10} {row['session_kb']:>10.1f}  {row['query'][:60]}{flag}")
+        print(f"total {sum(row['latency_ms'] for row in turns):>9.1f} {sum(row['calendar_round_trips'] for row in turns):>3} "
+              f"{sum(row['calendar_calls'] for row in turns):>4} {sum(row['llm_calls'] for row in turns):>3} "
+              f"{sum(row['prompt_tokens'] for row in turns):>10}")
+    print("\n== stages")
+    print(f"{'stage':<32} {'count':>6} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+    for stage, stats in stage_summary.items():
+        print(f"{stage:<32} {stats['count']:>6} {stats['p50_ms']:>8.1f} {stats['p95_ms']:>8.1f} {stats['max_ms']:>8.1f}")
+
+
+def compare(results, baseline, token_tolerance):
+    regressions = []
+    for name, turns in results.items():
+        for row, old in zip(turns, baseline.get(name, [])):
+            where = f"{name} turn {row['turn']} ({row['query'][:40]})"
+            for key in ('calendar_round_trips', 'calendar_calls', 'llm_calls'):
+                if row[key] > old[key]:
+                    regressions.append(f"{where}: {key} {old[key]} -> {row[key]}")
+            if row['prompt_tokens'] > old['prompt_tokens'] * (1 + token_tolerance):
+                regressions.append(f"{where}: prompt_tokens {old['prompt_tokens']} -> {row['prompt_tokens']}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS), help="run only these scenarios")
+    parser.add_argument('--events', type=int, default=500, help="events generated per user, spread over all calendars")
+    parser.add_argument('--calendars', type=int, default=3, help="calendars per user, including primary")
+    parser.add_argument('--page-size', type=int, default=250, help="largest page the fake Calendar API returns")
+    parser.add_argument('--calendar-latency-ms', type=float, default=50)
+    parser.add_argument('--llm-latency-ms', type=float, default=300)
+    parser.add_argument('--repeat', type=int, default=1, help="runs per scenario; latency is the median")
+    parser.add_argument('--output', help="write per-turn results as JSON")
+    parser.add_argument('--baseline', help="JSON from an earlier --output run to check for regressions")
+    parser.add_argument('--token-tolerance', type=float, default=0.1)
+    parser.add_argument('--import-budget-ms', type=float, default=IMPORT_BUDGET_MS)
+    parser.add_argument('--users', type=int, help="run each scenario as this many concurrent sessions through server.py")
+    parser.add_argument('--workers', type=int, default=64, help="server turn threads in --users mode")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    calendar = FakeCalendar(latency_ms=args.calendar_latency_ms, max_page_size=args.page_size)
+    use_transport_factory(calendar.transport)
+    llm = FakeOpenAI(latency_ms=args.llm_latency_ms)
+    openai.api_base = llm.api_base
+    openai.api_key = 'bench'
+
+    today = get_current_time().date()
+    results = {}
+    try:
+        if args.users:
+            for name in args.scenario or SCENARIOS:
+                script = SCENARIOS[name](today)
+                users, wall_seconds = asyncio.run(run_load(calendar, llm, name, script, args))
+                print_load_report(name, script, users, wall_seconds, args)
+            return 0
+        for name in args.scenario or SCENARIOS:
+            runs = []
+            for run in range(args.repeat):
+                runs.append(run_scenario(calendar, llm, name, SCENARIOS[name](today), args, run))
+            results[name] = aggregate(runs)
+    finally:
+        calendar.close()
+        llm.close()
+
+    print_report(results, process_stats.summary())
+    regressions = [f"{name} turn {row['turn']} failed: {row['query']}" for name, turns in results.items() for row in turns if row['error']]
+    regressions += check_imports(args.import_budget_ms)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions += compare(results, json.load(f), args.token_tolerance)
+    if regressions:
+        print("\nRegressions:")
+        print('\n'.join(regressions))
+        return 1
+    if args.baseline:
+        print("\nNo regressions against baseline.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,156 @@
+"""Per-user Google Calendar service objects cached for the life of the process.
+
+Building a service parses the discovery document. Here that happens once per
+user: the bundled static discovery document is used and access tokens are
+refreshed on a background timer before they expire. A user's service may be
+used by several threads at once (two browser tabs, or several API sessions for
+one account), and httplib2 transports are not thread-safe, so the service sends
+each request over a transport borrowed from a per-user pool. Idle transports
+keep their connections alive for the next request. The Google client libraries
+are imported on first use, not when this module is imported.
+"""
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Refresh this many seconds before the access token expires
+REFRESH_MARGIN_SECONDS = 300
+HTTP_TIMEOUT_SECONDS = 30
+MAX_CACHED_SERVICES = 256
+# Transports kept open per user between requests; more are opened under concurrency and closed after use
+MAX_IDLE_TRANSPORTS = 8
+
+
+def new_transport():
+    import httplib2
+    return httplib2.Http(timeout=HTTP_TIMEOUT_SECONDS)
+
+
+_transport_factory = new_transport
+
+
+def use_transport_factory(factory):
+    """Open every new transport with factory(); the offline benchmark points them at local fakes."""
+    global _transport_factory
+    _transport_factory = factory
+
+
+class TransportPool:
+    """Thread-safe stand-in for one authorized httplib2 transport.
+
+    Each request borrows an idle transport, or opens one when all are busy, and
+    returns it afterwards, so no transport is ever used by two threads at once.
+    """
+
+    def __init__(self, credentials, max_idle=MAX_IDLE_TRANSPORTS):
+        # googleapiclient reads credentials off the transport to refresh them after a 401
+        self.credentials = credentials
+        self.max_idle = max_idle
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def request(self, *args, **kwargs):
+        with self.lock:
+            http = self.idle.pop() if self.idle else None
+        if http is None:
+            import google_auth_httplib2
+            http = google_auth_httplib2.AuthorizedHttp(self.credentials, http=_transport_factory())
+        try:
+            return http.request(*args, **kwargs)
+        finally:
+            with self.lock:
+                keep = len(self.idle) < self.max_idle
+                if keep:
+                    self.idle.append(http)
+            if not keep:
+                http.close()
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for http in idle:
+            http.close()
+
+
+class CachedService:
+    def __init__(self, credentials):
+        self.credentials = credentials
+        self.lock = threading.Lock()
+        self.timer = None
+        self.service = build_service(credentials)
+
+    def refresh(self):
+        from google.auth.transport.requests import Request
+        with self.lock:
+            try:
+                self.credentials.refresh(Request())
+                logger.info("Refreshed calendar credentials ahead of expiry")
+            except Exception as e:
+                logger.error(f"Error refreshing credentials: {str(e)}")
+                return
+        self.schedule_refresh()
+
+    def schedule_refresh(self):
+        if self.timer:
+            self.timer.cancel()
+        if not self.credentials.refresh_token or not self.credentials.expiry:
+            return
+        # google-auth stores expiry as a naive UTC datetime
+        delay = (self.credentials.expiry - datetime.utcnow()).total_seconds() - REFRESH_MARGIN_SECONDS
+        self.timer = threading.Timer(max(delay, 0), self.refresh)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def close(self):
+        if self.timer:
+            self.timer.cancel()
+        self.service.close()
+
+
+def build_service(credentials):
+    from googleapiclient.discovery import build
+    return build('calendar', 'v3', http=TransportPool(credentials), static_discovery=True, cache_discovery=False)
+
+
+def _user_key(credentials_info):
+    identity = credentials_info.get('refresh_token') or credentials_info.get('token', '')
+    return hashlib.sha256(identity.encode()).hexdigest()
+
+
+_services = OrderedDict()
+_services_lock = threading.Lock()
+
+
+def get_cached_service(credentials_info, scopes):
+    key = _user_key(credentials_info)
+    with _services_lock:
+        cached = _services.get(key)
+        if cached is None:
+            from google.auth.transport.requests import Request
+            from google.oauth2.credentials import Credentials
+            credentials = Credentials.from_authorized_user_info(credentials_info, scopes)
+            if credentials.expired and credentials.refresh_token:
+                credentials.refresh(Request())
+            cached = CachedService(credentials)
+            cached.schedule_refresh()
+            _services[key] = cached
+            while len(_services) > MAX_CACHED_SERVICES:
+                _, evicted = _services.popitem(last=False)
+                evicted.close()
+        _services.move_to_end(key)
+
+    if cached.credentials.expired and cached.credentials.refresh_token:
+        # The background refresh failed or has not run yet; fall back to refreshing inline
+        cached.refresh()
+    return cached.service
+
+
+def drop_cached_service(credentials_info):
+    with _services_lock:
+        cached = _services.pop(_user_key(credentials_info), None)
+    if cached:
+        cached.close()
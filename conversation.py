@@ -0,0 +1,96 @@
+"""Token-budgeted conversation context for LLM prompts.
+
+The last few turns go into the prompt verbatim. Older turns are folded into a
+rolling one-line-per-turn summary, so prompt size stays flat however long the
+session runs.
+"""
+import json
+import os
+from typing import NamedTuple
+
+# Upper bound on the serialized context sent with every prompt
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', 1500))
+# Number of user/assistant exchanges kept verbatim
+RECENT_TURNS = int(os.environ.get('CONTEXT_RECENT_TURNS', 3))
+SUMMARY_LINE_CHARS = 100
+MAX_PROMPT_EVENTS = 20
+PROMPT_FACTS = ('last_mentioned_date', 'last_retrieved_date', 'last_retrieved_events')
+
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English text; close enough for budgeting
+    return len(text) // 4 + 1
+
+
+class EventRecord(NamedTuple):
+    # What the conversation keeps of a Calendar event; serializes to a JSON array
+    id: str
+    summary: str
+    start: str
+
+
+def compact_event(event):
+    start = event['start'].get('dateTime', event['start'].get('date'))
+    return EventRecord(event.get('id'), event.get('summary', ''), start)
+
+
+def summarize_message(message):
+    text = ' '.join(message['content'].split())
+    if len(text) > SUMMARY_LINE_CHARS:
+        text = text[:SUMMARY_LINE_CHARS - 3] + '...'
+    return f"{message['role']}: {text}"
+
+
+class ConversationContext:
+    def __init__(self, token_budget=CONTEXT_TOKEN_BUDGET, recent_turns=RECENT_TURNS):
+        self.token_budget = token_budget
+        self.recent_turns = recent_turns
+        self.summary = []
+        self.omitted = 0
+        self.folded = 0
+
+    def _fold(self, messages, upto):
+        # Messages already spilled from a MessageHistory before being folded count as omitted
+        skipped = getattr(messages, 'start', 0) - self.folded
+        if skipped > 0:
+            self.omitted += skipped
+            self.folded += skipped
+        for message in messages[self.folded:upto]:
+            self.summary.append(summarize_message(message))
+        self.folded = max(self.folded, upto)
+
+    def _summary_text(self):
+        lines = list(self.summary)
+        if self.omitted:
+            lines.insert(0, f"({self.omitted} earlier messages omitted)")
+        return '\n'.join(lines)
+
+    def prompt_context(self, context, messages):
+        """Context dict for a prompt, within the token budget."""
+        self._fold(messages, max(len(messages) - self.recent_turns * 2, 0))
+
+        facts = {key: context[key] for key in PROMPT_FACTS if context.get(key)}
+        if 'last_retrieved_events' in facts:
+            facts['last_retrieved_events'] = facts['last_retrieved_events'][:MAX_PROMPT_EVENTS]
+
+        while True:
+            recent = messages[self.folded:]
+            prompt = dict(facts)
+            if self.summary or self.omitted:
+                prompt['conversation_summary'] = self._summary_text()
+            prompt['recent_messages'] = [{'role': m['role'], 'content': m['content']} for m in recent]
+            if estimate_tokens(json.dumps(prompt)) <= self.token_budget:
+                return prompt
+            # Over budget: fold the oldest verbatim message, then drop the oldest summary lines
+            if len(recent) > 1:
+                self._fold(messages, self.folded + 1)
+            elif self.summary:
+                self.summary.pop(0)
+                self.omitted += 1
+            else:
+                # A single oversized message: keep only as much of its tail as fits
+                if prompt['recent_messages']:
+                    content = prompt['recent_messages'][-1]['content']
+                    excess = (estimate_tokens(json.dumps(prompt)) - self.token_budget) * 4
+                    prompt['recent_messages'][-1]['content'] = content[min(len(content), excess):]
+                return prompt
@@ -0,0 +1,110 @@
+"""Trigram search index over event titles, descriptions, locations and attendees.
+
+Matching on character trigrams of individual words tolerates typos and ignores
+word order. The index is updated one event at a time, so it only has to be built
+once per user, and it holds keys and trigrams rather than event dicts.
+"""
+import re
+import sys
+import time
+from collections import Counter, defaultdict
+
+FIELD_WEIGHTS = {'summary': 3.0, 'location': 1.5, 'attendees': 1.5, 'description': 1.0}
+# Share of the query's trigrams a candidate must contain to be considered
+MIN_SIMILARITY = 0.3
+STOP_WORDS = {'the', 'a', 'an', 'my', 'thing', 'event', 'events', 'meeting', 'about', 'with', 'for', 'on', 'at', 'of', 'to', 'and', 'details'}
+
+
+def tokenize(text):
+    return [token for token in re.findall(r'\w+', text.lower()) if token not in STOP_WORDS]
+
+
+def trigrams(text):
+    grams = set()
+    for token in tokenize(text):
+        padded = f"  {token} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def event_fields(event):
+    attendees = ' '.join(
+        f"{attendee.get('displayName', '')} {attendee.get('email', '').split('@')[0]}"
+        for attendee in event.get('attendees', [])
+    )
+    return {
+        'summary': event.get('summary', ''),
+        'location': event.get('location', ''),
+        'attendees': attendees,
+        'description': event.get('description', ''),
+    }
+
+
+class EventSearchIndex:
+    """Trigram postings per event key; the events themselves are not kept.
+
+    Each posting records the weight of the best field the trigram occurs in, so
+    scoring needs nothing but the postings. Callers map the returned
+    (calendar_id, event_id) keys back to events.
+    """
+
+    def __init__(self, events=()):
+        # events: iterable of (event, start timestamp) pairs
+        self.docs = {}
+        self.postings = defaultdict(dict)
+        for event, start_ts in events:
+            self.upsert(event, start_ts)
+
+    def upsert(self, event, start_ts):
+        key = (event.get('calendarId', 'primary'), event['id'])
+        self.remove(*key)
+        weights = {}
+        for name, text in event_fields(event).items():
+            for gram in trigrams(text):
+                weights[gram] = max(weights.get(gram, 0), FIELD_WEIGHTS[name])
+        # Interned trigrams are shared by every event that contains them
+        self.docs[key] = (start_ts, tuple(sys.intern(gram) for gram in weights))
+        for gram, weight in weights.items():
+            self.postings[sys.intern(gram)][key] = weight
+
+    def remove(self, calendar_id, event_id):
+        key = (calendar_id, event_id)
+        doc = self.docs.pop(key, None)
+        if doc is None:
+            return
+        for gram in doc[1]:
+            keys = self.postings.get(gram)
+            if keys is not None:
+                keys.pop(key, None)
+                if not keys:
+                    del self.postings[gram]
+
+    def search(self, query, limit=5, start_ts=None, end_ts=None):
+        """Best matching events as (score, (calendar_id, event_id)) pairs, highest score first."""
+        query_grams = trigrams(query)
+        if not query_grams:
+            return []
+        shared = Counter()
+        weights = Counter()
+        for gram in query_grams:
+            # Each query trigram counts once, at the weight of the best field containing it
+            for key, weight in self.postings.get(gram, {}).items():
+                shared[key] += 1
+                weights[key] += weight
+
+        now = time.time()
+        top_weight = max(FIELD_WEIGHTS.values())
+        results = []
+        for key, count in shared.items():
+            if count / len(query_grams) < MIN_SIMILARITY:
+                continue
+            event_ts = self.docs[key][0]
+            if (start_ts is not None and event_ts < start_ts) or (end_ts is not None and event_ts >= end_ts):
+                continue
+            score = weights[key] / (top_weight * len(query_grams))
+            # Prefer events close to now, and upcoming ones over past ones
+            days_away = abs(event_ts - now) / 86400
+            score -= 0.05 * min(days_away / 30, 1) + (0.05 if event_ts < now else 0)
+            results.append((score, key))
+        results.sort(key=lambda result: result[0], reverse=True)
+        return results[:limit]
@@ -0,0 +1,331 @@
+"""Local per-user Google Calendar event store kept current with syncToken incremental sync.
+
+The store lives at module level so it survives Streamlit reruns; only the main
+script is re-executed on each interaction, imported modules are not. Its
+in-memory indexes hold event keys, not event dicts, and are kept for at most
+MAX_CACHED_USERS recently active users; the SQLite copy is kept for everyone.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import pytz
+
+from event_search import EventSearchIndex
+from intervals import IntervalTree
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+malaysia_tz = pytz.timezone('Asia/Kuala_Lumpur')
+
+EVENT_STORE_PATH = os.environ.get('EVENT_STORE_PATH', 'event_store.sqlite3')
+# Reads within this many seconds of the last sync are answered without any API call.
+SYNC_INTERVAL_SECONDS = 30
+# How far back the initial full sync reaches; older ranges fall back to a live query.
+SYNC_WINDOW_DAYS = 365
+# Calendar API limit on calls per batch request
+MAX_BATCH_SIZE = 50
+# Sync pages are large to keep round trips down; streamed listings use small pages
+# so the first events arrive quickly.
+SYNC_PAGE_SIZE = 2500
+STREAM_PAGE_SIZE = 250
+# Users whose interval and search indexes stay in memory; older ones are rebuilt from SQLite on next use
+MAX_CACHED_USERS = int(os.environ.get('EVENT_STORE_MAX_CACHED_USERS', 256))
+# Partial-response projections: only the event fields the assistant reads
+EVENT_FIELDS = 'id,status,summary,description,location,start,end,transparency,htmlLink,attendees(email,displayName,responseStatus)'
+EVENT_SYNC_FIELDS = f'nextPageToken,nextSyncToken,items({EVENT_FIELDS})'
+EVENT_LIST_FIELDS = f'nextPageToken,items({EVENT_FIELDS})'
+
+
+def event_bounds(event):
+    """Return (start, end) of a Calendar event as aware datetimes; all-day events span whole days."""
+    bounds = []
+    for key in ('start', 'end'):
+        value = event.get(key, {})
+        if 'dateTime' in value:
+            bounds.append(datetime.fromisoformat(value['dateTime'].replace('Z', '+00:00')))
+        else:
+            day = datetime.fromisoformat(value['date'])
+            bounds.append(malaysia_tz.localize(day))
+    return bounds[0], bounds[1]
+
+
+class EventStore:
+    def __init__(self, path=EVENT_STORE_PATH):
+        self.path = path
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS events (
+                user_id TEXT NOT NULL,
+                calendar_id TEXT NOT NULL,
+                event_id TEXT NOT NULL,
+                start_ts REAL NOT NULL,
+                end_ts REAL NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (user_id, calendar_id, event_id)
+            );
+            CREATE INDEX IF NOT EXISTS events_by_start ON events (user_id, calendar_id, start_ts);
+            CREATE TABLE IF NOT EXISTS sync_state (
+                user_id TEXT NOT NULL,
+                calendar_id TEXT NOT NULL,
+                sync_token TEXT,
+                window_start_ts REAL NOT NULL,
+                last_synced REAL NOT NULL,
+                PRIMARY KEY (user_id, calendar_id)
+            );
+        """)
+        self.conn.commit()
+        # Bumped on every change so derived indexes know when to rebuild.
+        self.versions = {}
+        self.indexes = {}
+        self.sync_locks = {}
+        # Built on a user's first search, then kept current by _apply and clear
+        self.search_indexes = {}
+        # Users with state in the dicts above, least recently used first
+        self.cached_users = OrderedDict()
+
+    def _touch(self, user_id):
+        self.cached_users[user_id] = None
+        self.cached_users.move_to_end(user_id)
+        while len(self.cached_users) > MAX_CACHED_USERS:
+            self.forget(next(iter(self.cached_users)))
+
+    def forget(self, user_id):
+        """Drop user_id's in-memory indexes, e.g. on logout; their synced events stay on disk."""
+        with self.lock:
+            self.cached_users.pop(user_id, None)
+            self.search_indexes.pop(user_id, None)
+            for key in [key for key in self.indexes if key[0] == user_id]:
+                del self.indexes[key]
+            for key in [key for key in self.versions if key[0] == user_id]:
+                del self.versions[key]
+            sync_lock = self.sync_locks.get(user_id)
+            if sync_lock is not None and not sync_lock.locked():
+                del self.sync_locks[user_id]
+
+    def _load(self, user_id, keys):
+        # Indexes only hold keys; the few events a lookup returns are read back by primary key
+        events = {}
+        for calendar_id, event_id in keys:
+            row = self.conn.execute(
+                'SELECT data FROM events WHERE user_id = ? AND calendar_id = ? AND event_id = ?',
+                (user_id, calendar_id, event_id)
+            ).fetchone()
+            if row:
+                events[(calendar_id, event_id)] = json.loads(row[0])
+        return events
+
+    def _bump(self, user_id, calendar_id):
+        key = (user_id, calendar_id)
+        self.versions[key] = self.versions.get(key, 0) + 1
+
+    def _sync_state(self, user_id, calendar_id):
+        row = self.conn.execute(
+            'SELECT sync_token, window_start_ts, last_synced FROM sync_state WHERE user_id = ? AND calendar_id = ?',
+            (user_id, calendar_id)
+        ).fetchone()
+        if row is None:
+            return None
+        return {'sync_token': row[0], 'window_start_ts': row[1], 'last_synced': row[2]}
+
+    def _apply(self, user_id, calendar_id, event):
+        self._bump(user_id, calendar_id)
+        event['calendarId'] = calendar_id
+        search_index = self.search_indexes.get(user_id)
+        if event.get('status') == 'cancelled':
+            self.conn.execute(
+                'DELETE FROM events WHERE user_id = ? AND calendar_id = ? AND event_id = ?',
+                (user_id, calendar_id, event['id'])
+            )
+            if search_index:
+                search_index.remove(calendar_id, event['id'])
+            return
+        start, end = event_bounds(event)
+        if search_index:
+            search_index.upsert(event, start.timestamp())
+        self.conn.execute(
+            'INSERT OR REPLACE INTO events (user_id, calendar_id, event_id, start_ts, end_ts, data) VALUES (?, ?, ?, ?, ?, ?)',
+            (user_id, calendar_id, event['id'], start.timestamp(), end.timestamp(), json.dumps(event))
+        )
+
+    def clear(self, user_id, calendar_id='primary'):
+        with self.lock:
+            self._bump(user_id, calendar_id)
+            search_index = self.search_indexes.get(user_id)
+            if search_index:
+                for key in [key for key in search_index.docs if key[0] == calendar_id]:
+                    search_index.remove(*key)
+            self.conn.execute('DELETE FROM events WHERE user_id = ? AND calendar_id = ?', (user_id, calendar_id))
+            self.conn.execute('DELETE FROM sync_state WHERE user_id = ? AND calendar_id = ?', (user_id, calendar_id))
+            self.conn.commit()
+
+    def _sync_params(self, user_id, calendar_id, force):
+        state = self._sync_state(user_id, calendar_id)
+        if state and not force and time.time() - state['last_synced'] < SYNC_INTERVAL_SECONDS:
+            return None
+        params = {'calendarId': calendar_id, 'singleEvents': True, 'maxResults': SYNC_PAGE_SIZE, 'fields': EVENT_SYNC_FIELDS}
+        if state and state['sync_token']:
+            params['syncToken'] = state['sync_token']
+            window_start_ts = state['window_start_ts']
+        else:
+            window_start = datetime.now(malaysia_tz) - timedelta(days=SYNC_WINDOW_DAYS)
+            params['timeMin'] = window_start.isoformat()
+            window_start_ts = window_start.timestamp()
+        return params, window_start_ts
+
+    def sync(self, service, user_id, calendar_ids=('primary',), force=False):
+        """Bring the local copies up to date: a full sync the first time, incremental via syncToken after.
+
+        All calendars are fetched together: each round sends one batch HTTP request
+        holding the next page of every calendar that still has pages left.
+        """
+        with self.lock:
+            self._touch(user_id)
+            sync_lock = self.sync_locks.setdefault(user_id, threading.Lock())
+        with sync_lock:
+            with self.lock:
+                pending = {}
+                for calendar_id in calendar_ids:
+                    params = self._sync_params(user_id, calendar_id, force)
+                    if params:
+                        pending[calendar_id] = params
+
+            errors = {}
+            while pending:
+                results = {}
+
+                def collect(request_id, response, exception):
+                    results[request_id] = (response, exception)
+
+                calendar_order = list(pending)
+                for chunk_start in range(0, len(calendar_order), MAX_BATCH_SIZE):
+                    batch = service.new_batch_http_request(callback=collect)
+                    positions = range(chunk_start, min(chunk_start + MAX_BATCH_SIZE, len(calendar_order)))
+                    for position in positions:
+                        batch.add(service.events().list(**pending[calendar_order[position]][0]), request_id=str(position))
+                    with span('calendar.batch.sync', calls=len(positions)):
+                        batch.execute()
+
+                with self.lock:
+                    for position, calendar_id in enumerate(calendar_order):
+                        params, window_start_ts = pending.pop(calendar_id)
+                        events_result, exception = results.get(str(position), (None, None))
+                        if exception is not None:
+                            # googleapiclient is already loaded by the time a request has failed
+                            from googleapiclient.errors import HttpError
+                            if isinstance(exception, HttpError) and exception.resp.status == 410 and 'syncToken' in params:
+                                # The sync token expired; Google requires a fresh full sync.
+                                logger.info(f"Sync token expired for {user_id}/{calendar_id}, running full sync")
+                                self.clear(user_id, calendar_id)
+                                pending[calendar_id] = self._sync_params(user_id, calendar_id, True)
+                            else:
+                                errors[calendar_id] = exception
+                            continue
+
+                        for event in events_result.get('items', []):
+                            self._apply(user_id, calendar_id, event)
+                        if events_result.get('nextPageToken'):
+                            pending[calendar_id] = (dict(params, pageToken=events_result['nextPageToken']), window_start_ts)
+                            continue
+                        self.conn.execute(
+                            'INSERT OR REPLACE INTO sync_state (user_id, calendar_id, sync_token, window_start_ts, last_synced) VALUES (?, ?, ?, ?, ?)',
+                            (user_id, calendar_id, events_result.get('nextSyncToken'), window_start_ts, time.time())
+                        )
+                        logger.info(f"Synced events for {user_id}/{calendar_id} ({'incremental' if 'syncToken' in params else 'full'})")
+                    self.conn.commit()
+
+            if errors:
+                logger.warning(f"Sync failed for calendars: {', '.join(errors)}")
+                raise next(iter(errors.values()))
+
+    def covers(self, user_id, start_datetime, calendar_ids=('primary',)):
+        with self.lock:
+            states = [self._sync_state(user_id, calendar_id) for calendar_id in calendar_ids]
+        return all(state is not None and start_datetime.timestamp() >= state['window_start_ts'] for state in states)
+
+    def events_between(self, user_id, start_datetime, end_datetime, calendar_ids=('primary',)):
+        """Events overlapping [start, end) across calendar_ids, merged in start-time order."""
+        placeholders = ', '.join('?' for _ in calendar_ids)
+        with self.lock:
+            rows = self.conn.execute(
+                f'SELECT data FROM events WHERE user_id = ? AND calendar_id IN ({placeholders}) AND start_ts < ? AND end_ts > ? ORDER BY start_ts',
+                (user_id, *calendar_ids, end_datetime.timestamp(), start_datetime.timestamp())
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def interval_index(self, user_id, calendar_id='primary'):
+        """IntervalTree of event ids over all stored events keyed by epoch seconds, rebuilt only after changes."""
+        key = (user_id, calendar_id)
+        with self.lock:
+            self._touch(user_id)
+            version = self.versions.get(key, 0)
+            cached = self.indexes.get(key)
+            if cached and cached[0] == version:
+                return cached[1]
+            rows = self.conn.execute(
+                'SELECT start_ts, end_ts, event_id FROM events WHERE user_id = ? AND calendar_id = ?',
+                (user_id, calendar_id)
+            ).fetchall()
+            index = IntervalTree(rows)
+            self.indexes[key] = (version, index)
+            return index
+
+    def overlapping(self, user_id, start_datetime, end_datetime, calendar_ids=('primary',)):
+        """Interval-index lookup across calendars, in start-time order."""
+        start_ts, end_ts = start_datetime.timestamp(), end_datetime.timestamp()
+        with self.lock:
+            keys = [(calendar_id, event_id) for calendar_id in calendar_ids
+                    for event_id in self.interval_index(user_id, calendar_id).overlapping(start_ts, end_ts)]
+            events = self._load(user_id, keys)
+        return sorted(events.values(), key=lambda event: event_bounds(event)[0])
+
+    def search(self, user_id, query, calendar_ids=('primary',), limit=5, start_datetime=None, end_datetime=None):
+        """Ranked (score, event) matches for a free-text query across calendar_ids."""
+        with self.lock:
+            self._touch(user_id)
+            search_index = self.search_indexes.get(user_id)
+            if search_index is None:
+                rows = self.conn.execute('SELECT start_ts, data FROM events WHERE user_id = ?', (user_id,)).fetchall()
+                search_index = EventSearchIndex((json.loads(data), start_ts) for start_ts, data in rows)
+                self.search_indexes[user_id] = search_index
+            results = search_index.search(
+                query,
+                limit=limit * len(calendar_ids),
+                start_ts=start_datetime.timestamp() if start_datetime else None,
+                end_ts=end_datetime.timestamp() if end_datetime else None,
+            )
+            results = [(score, key) for score, key in results if key[0] in calendar_ids][:limit]
+            events = self._load(user_id, [key for _, key in results])
+        return [(score, events[key]) for score, key in results if key in events]
+
+    def upsert_event(self, user_id, event, calendar_id='primary'):
+        with self.lock:
+            self._touch(user_id)
+            self._apply(user_id, calendar_id, event)
+            self.conn.commit()
+
+    def delete_event(self, user_id, event_id, calendar_id='primary'):
+        with self.lock:
+            self._touch(user_id)
+            self._apply(user_id, calendar_id, {'id': event_id, 'status': 'cancelled'})
+            self.conn.commit()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_event_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = EventStore()
+        return _store
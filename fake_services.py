@@ -0,0 +1,310 @@
+"""Local stand-ins for the Google Calendar v3 and OpenAI ChatCompletion APIs.
+
+Both run as threaded HTTP servers on localhost with configurable latency, and
+count every request they serve so a benchmark can report round trips per turn.
+The Calendar fake supports paging, syncToken incremental sync, batch requests,
+freebusy and event writes; the OpenAI fake answers function calls and streamed
+replies from canned responses keyed by the user's query.
+"""
+import email
+import json
+import random
+import threading
+import time
+import urllib.parse
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httplib2
+
+from conversation import estimate_tokens
+from event_store import event_bounds
+from llm_cache import normalize_query
+
+GOOGLE_ROOT_URL = 'https://www.googleapis.com/'
+TITLE_WORDS = ['Planning', 'Standup', 'Review', 'Sync', '1:1', 'Retro', 'Demo', 'Interview', 'Lunch', 'Workshop']
+TOPIC_WORDS = ['budget', 'roadmap', 'hiring', 'design', 'launch', 'vendor', 'support', 'infra', 'marketing', 'security']
+LOCATIONS = ['Room 3A', 'Room 5C', 'Google Meet', 'Cafe', 'Board room']
+PEOPLE = ['aisha', 'wei.ling', 'ravi', 'daniel', 'siti', 'marcus']
+
+
+def parse_time(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+
+def event_times(event):
+    # Epoch bounds of timed and all-day events alike, as the app reads them
+    start, end = event_bounds(event)
+    return start.timestamp(), end.timestamp()
+
+
+def generate_events(count, calendar_ids, tz, seed=0, first_day=-30, last_day=60):
+    """count timed events spread over the days from first_day to last_day relative to today, working hours only."""
+    rng = random.Random(seed)
+    today = datetime.now(tz).replace(hour=0, minute=0, second=0, microsecond=0)
+    events = []
+    for number in range(count):
+        start = today + timedelta(days=rng.randint(first_day, last_day), hours=rng.randint(9, 17), minutes=rng.choice([0, 30]))
+        event = {
+            'summary': f"{rng.choice(TOPIC_WORDS).title()} {rng.choice(TITLE_WORDS)}",
+            'start': {'dateTime': start.isoformat(), 'timeZone': str(tz)},
+            'end': {'dateTime': (start + timedelta(minutes=rng.choice([30, 60, 90]))).isoformat(), 'timeZone': str(tz)},
+        }
+        if rng.random() < 0.4:
+            event['location'] = rng.choice(LOCATIONS)
+        if rng.random() < 0.5:
+            event['attendees'] = [{'email': f"{name}@example.com", 'responseStatus': 'accepted'} for name in rng.sample(PEOPLE, 2)]
+        events.append((calendar_ids[number % len(calendar_ids)], event))
+    return events
+
+
+class FakeServer:
+    """Runs handle_http() of a subclass on a background ThreadingHTTPServer."""
+
+    def __init__(self, latency_ms=0):
+        self.latency_ms = latency_ms
+        self.lock = threading.Lock()
+        self.round_trips = 0
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_request(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                with fake.lock:
+                    fake.round_trips += 1
+                time.sleep(fake.latency_ms / 1000)
+                fake.handle_http(self, body)
+
+            do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = do_request
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    @staticmethod
+    def reply(handler, status, payload=None, content_type='application/json'):
+        body = b'' if payload is None else payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        handler.send_response(status)
+        handler.send_header('Content-Type', content_type)
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+
+class LocalHttp(httplib2.Http):
+    """httplib2 transport that sends requests meant for googleapis.com to a local server."""
+
+    def __init__(self, base_url):
+        super().__init__(timeout=30)
+        self.base_url = base_url
+
+    def request(self, uri, *args, **kwargs):
+        return super().request(uri.replace(GOOGLE_ROOT_URL, self.base_url, 1), *args, **kwargs)
+
+
+class FakeCalendar(FakeServer):
+    def __init__(self, latency_ms=0, max_page_size=2500):
+        super().__init__(latency_ms)
+        self.max_page_size = max_page_size
+        self.reset('bench@example.com')
+
+    def reset(self, user_id, calendar_ids=(), events=()):
+        """Start over with a primary calendar for user_id, extra followed calendars and (calendar_id, event) pairs."""
+        with self.lock:
+            self.user_id = user_id
+            self.calendar_ids = [user_id, *calendar_ids]
+            self.events = {}
+            self.changed = {}
+            self.seq = 0
+            self.next_id = 0
+            self.calls = 0
+            for calendar_id, event in events:
+                self._insert(self._calendar(calendar_id), dict(event))
+
+    def transport(self):
+        return LocalHttp(self.url)
+
+    def _calendar(self, calendar_id):
+        return self.user_id if calendar_id == 'primary' else calendar_id
+
+    def _touch(self, key):
+        self.seq += 1
+        self.changed[key] = self.seq
+
+    def _insert(self, calendar_id, event):
+        self.next_id += 1
+        event.update(id=f"ev{self.next_id:06d}", status='confirmed', htmlLink=f"https://calendar.example/ev{self.next_id:06d}")
+        self.events[(calendar_id, event['id'])] = event
+        self._touch((calendar_id, event['id']))
+        return event
+
+    def _list(self, calendar_id, params):
+        size = min(int(params.get('maxResults', 250)), self.max_page_size)
+        if 'syncToken' in params:
+            since = int(params['syncToken'])
+            keys = sorted((key for key in self.events if key[0] == calendar_id and self.changed[key] > since), key=self.changed.get)
+            items = [self.events[key] for key in keys]
+        else:
+            time_min = parse_time(params['timeMin']) if 'timeMin' in params else float('-inf')
+            time_max = parse_time(params['timeMax']) if 'timeMax' in params else float('inf')
+            items = sorted(
+                (event for (calendar, _), event in self.events.items()
+                 if calendar == calendar_id and event['status'] != 'cancelled'
+                 and event_times(event)[0] < time_max and event_times(event)[1] > time_min),
+                key=lambda event: event_times(event)[0]
+            )
+        offset = int(params.get('pageToken', 0))
+        result = {'kind': 'calendar#events', 'items': items[offset:offset + size]}
+        if offset + size < len(items):
+            result['nextPageToken'] = str(offset + size)
+        else:
+            result['nextSyncToken'] = str(self.seq)
+        return result
+
+    def _freebusy(self, body):
+        time_min, time_max = parse_time(body['timeMin']), parse_time(body['timeMax'])
+        calendars = {}
+        for item in body.get('items', []):
+            calendar_id = self._calendar(item['id'])
+            busy = [{'start': start.isoformat(), 'end': end.isoformat()}
+                    for (calendar, _), event in self.events.items()
+                    if calendar == calendar_id and event['status'] != 'cancelled' and event.get('transparency') != 'transparent'
+                    for start, end in [event_bounds(event)]
+                    if start.timestamp() < time_max and end.timestamp() > time_min]
+            calendars[item['id']] = {'busy': busy}
+        return {'kind': 'calendar#freeBusy', 'calendars': calendars}
+
+    def handle(self, method, path, body):
+        """One Calendar API call: returns (status, payload)."""
+        with self.lock:
+            self.calls += 1
+            url = urllib.parse.urlsplit(path)
+            params = dict(urllib.parse.parse_qsl(url.query))
+            parts = [urllib.parse.unquote(part) for part in url.path.split('/') if part][2:]  # drop calendar/v3
+            data = json.loads(body) if body else {}
+
+            if parts == ['users', 'me', 'calendarList']:
+                items = [{'id': calendar_id, 'summary': calendar_id, 'selected': True, 'primary': calendar_id == self.user_id, 'accessRole': 'owner'}
+                         for calendar_id in self.calendar_ids]
+                return 200, {'kind': 'calendar#calendarList', 'items': items}
+            if parts == ['freeBusy'] and method == 'POST':
+                return 200, self._freebusy(data)
+            if len(parts) >= 3 and parts[0] == 'calendars' and parts[2] == 'events':
+                calendar_id = self._calendar(parts[1])
+                if len(parts) == 3:
+                    if method == 'GET':
+                        if 'syncToken' in params and int(params['syncToken']) > self.seq:
+                            return 410, {'error': {'code': 410, 'message': 'Sync token is no longer valid, a full sync is required.'}}
+                        return 200, self._list(calendar_id, params)
+                    if method == 'POST':
+                        return 200, self._insert(calendar_id, data)
+                key = (calendar_id, parts[3]) if len(parts) == 4 else None
+                event = self.events.get(key)
+                if event is None or event['status'] == 'cancelled':
+                    return 404, {'error': {'code': 404, 'message': 'Not Found'}}
+                if method == 'GET':
+                    return 200, event
+                if method in ('PUT', 'PATCH'):
+                    if method == 'PUT':
+                        event.clear()
+                        event.update(id=key[1], status='confirmed', htmlLink=f"https://calendar.example/{key[1]}")
+                    event.update({name: value for name, value in data.items() if name not in ('id', 'status')})
+                    self._touch(key)
+                    return 200, event
+                if method == 'DELETE':
+                    event['status'] = 'cancelled'
+                    self._touch(key)
+                    return 204, None
+            return 404, {'error': {'code': 404, 'message': f"No fake for {method} {url.path}"}}
+
+    def handle_http(self, handler, body):
+        if handler.path.startswith('/batch/'):
+            self.handle_batch(handler, body)
+            return
+        status, payload = self.handle(handler.command, handler.path, body)
+        self.reply(handler, status, payload)
+
+    def handle_batch(self, handler, body):
+        # multipart/mixed of application/http parts in, the same shape out
+        message = email.message_from_bytes(f"Content-Type: {handler.headers['Content-Type']}\r\n\r\n".encode() + body)
+        boundary = 'batch_fake_boundary'
+        out = []
+        for part in message.get_payload():
+            request_line, rest = part.get_payload().split('\n', 1)
+            method, path, _ = request_line.split(' ', 2)
+            inner_body = email.message_from_string(rest).get_payload() or None
+            status, payload = self.handle(method, path, inner_body)
+            content = '' if payload is None else json.dumps(payload)
+            content_id = part['Content-ID']
+            out.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <response-{content_id[1:-1]}>\r\n\r\n"
+                f"HTTP/1.1 {status} {'OK' if status < 300 else 'Error'}\r\nContent-Type: application/json\r\n\r\n{content}\r\n"
+            )
+        out.append(f"--{boundary}--\r\n")
+        self.reply(handler, 200, ''.join(out).encode(), content_type=f"multipart/mixed; boundary={boundary}")
+
+
+class FakeOpenAI(FakeServer):
+    def __init__(self, latency_ms=0, chunk_ms=5):
+        super().__init__(latency_ms)
+        self.chunk_ms = chunk_ms
+        self.reset()
+
+    @property
+    def api_base(self):
+        return self.url + 'v1'
+
+    def reset(self, extractions=None, replies=None):
+        """Canned answers keyed by normalized query: function-call arguments, and free-text replies."""
+        with self.lock:
+            self.extractions = {normalize_query(query): value for query, value in (extractions or {}).items()}
+            self.replies = {normalize_query(query): value for query, value in (replies or {}).items()}
+            self.requests = []
+
+    @staticmethod
+    def user_query(messages):
+        content = next((m['content'] for m in reversed(messages) if m['role'] == 'user'), '')
+        return content.rsplit('Current query: ', 1)[-1]
+
+    def handle_http(self, handler, body):
+        request = json.loads(body)
+        query = normalize_query(self.user_query(request['messages']))
+        prompt_tokens = estimate_tokens(json.dumps({'messages': request['messages'], 'functions': request.get('functions', [])}))
+        if request.get('functions'):
+            arguments = json.dumps(self.extractions.get(query, {'intent': 'general_query'}))
+            message = {'role': 'assistant', 'content': None, 'function_call': {'name': request['functions'][0]['name'], 'arguments': arguments}}
+            completion_text = arguments
+        else:
+            completion_text = self.replies.get(query, "I can help you plan your week and keep your calendar tidy.")
+            message = {'role': 'assistant', 'content': completion_text}
+        with self.lock:
+            self.requests.append({'query': query, 'prompt_tokens': prompt_tokens, 'stream': bool(request.get('stream'))})
+
+        if request.get('stream'):
+            handler.send_response(200)
+            handler.send_header('Content-Type', 'text/event-stream')
+            handler.end_headers()
+            for word in completion_text.split(' '):
+                chunk = {'object': 'chat.completion.chunk', 'model': request['model'],
+                         'choices': [{'index': 0, 'delta': {'content': word + ' '}, 'finish_reason': None}]}
+                handler.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                handler.wfile.flush()
+                time.sleep(self.chunk_ms / 1000)
+            handler.wfile.write(b"data: [DONE]\n\n")
+            return
+        self.reply(handler, 200, {
+            'id': 'chatcmpl-fake', 'object': 'chat.completion', 'model': request['model'],
+            'choices': [{'index': 0, 'message': message, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': estimate_tokens(completion_text),
+                      'total_tokens': prompt_tokens + estimate_tokens(completion_text)},
+        })
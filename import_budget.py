@@ -0,0 +1,41 @@
+"""Cold-start import budget for the assistant core.
+
+Importing assistant is the first thing both the Streamlit app and the API server
+do, so it has to stay cheap. measure_import() times it in a fresh interpreter and
+reports which of the libraries meant to load on first use it pulled in;
+test_import_budget.py asserts the budget and bench.py reports it after each run.
+"""
+import json
+import os
+import subprocess
+import sys
+
+IMPORT_BUDGET_MS = float(os.environ.get('IMPORT_BUDGET_MS', 150))
+# Libraries the core imports on first use; loading any of them at import is a regression
+DEFERRED_MODULES = ('openai', 'aiohttp', 'googleapiclient', 'httplib2', 'google_auth_httplib2', 'google_auth_oauthlib', 'dateutil', 'numpy')
+
+
+def measure_import(module, runs=3):
+    """Best-of-runs import time of module in a fresh interpreter (ms), and deferred modules it loaded."""
+    code = (
+        "import json, sys, time\n"
+        "start = time.perf_counter()\n"
+        f"import {module}\n"
+        "elapsed = (time.perf_counter() - start) * 1000\n"
+        f"print(json.dumps([elapsed, [name for name in {DEFERRED_MODULES!r} if name in sys.modules]]))\n"
+    )
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    return min(elapsed for elapsed, _ in samples), samples[-1][1]
+
+
+def import_problems(elapsed_ms, loaded, budget_ms=IMPORT_BUDGET_MS, module='assistant'):
+    problems = []
+    if elapsed_ms > budget_ms:
+        problems.append(f"importing {module} took {elapsed_ms:.1f} ms, over the {budget_ms:.0f} ms budget")
+    if loaded:
+        problems.append(f"importing {module} loaded {', '.join(loaded)}; these should be imported on first use")
+    return problems
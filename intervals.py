@@ -0,0 +1,116 @@
+"""Interval index for overlap queries and sweep helpers for free-slot search."""
+from datetime import datetime, timedelta
+
+
+class IntervalTree:
+    """Static centered interval tree over half-open [start, end) intervals.
+
+    Overlap queries cost O(log n + k). The tree is immutable; rebuild it when the
+    underlying events change.
+    """
+
+    __slots__ = ('center', 'by_start', 'by_end', 'left', 'right')
+
+    def __init__(self, intervals):
+        # intervals: iterable of (start, end, payload)
+        intervals = list(intervals)
+        self.left = self.right = None
+        self.by_start = self.by_end = []
+        if not intervals:
+            self.center = None
+            return
+        # Centering on an interval midpoint guarantees that interval stays in this node,
+        # so both children are strictly smaller.
+        midpoints = sorted(start + (end - start) / 2 for start, end, _ in intervals)
+        self.center = center = midpoints[len(midpoints) // 2]
+
+        left, right, here = [], [], []
+        for interval in intervals:
+            start, end, _ = interval
+            if end <= center and start < center:
+                left.append(interval)
+            elif start > center:
+                right.append(interval)
+            else:
+                here.append(interval)
+
+        self.by_start = sorted(here, key=lambda interval: interval[0])
+        self.by_end = sorted(here, key=lambda interval: interval[1], reverse=True)
+        if left:
+            self.left = IntervalTree(left)
+        if right:
+            self.right = IntervalTree(right)
+
+    def overlapping(self, start, end):
+        """Payloads of intervals overlapping [start, end), ordered by interval start."""
+        found = []
+        self._collect(start, end, found)
+        found.sort(key=lambda interval: interval[0])
+        return [payload for _, _, payload in found]
+
+    def _collect(self, start, end, found):
+        node = self
+        while node is not None and node.center is not None:
+            if end <= node.center:
+                for interval in node.by_start:
+                    if interval[0] >= end:
+                        break
+                    found.append(interval)
+                node = node.left
+            elif start > node.center:
+                for interval in node.by_end:
+                    if interval[1] <= start:
+                        break
+                    found.append(interval)
+                node = node.right
+            else:
+                found.extend(node.by_start)
+                if node.left is not None:
+                    node.left._collect(start, end, found)
+                node = node.right
+
+
+def merge_intervals(intervals):
+    """Merge (start, end) pairs into disjoint busy blocks with a single sorted sweep."""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+def free_windows(busy, window_start, window_end, min_duration):
+    """Gaps of at least min_duration inside [window_start, window_end) not covered by busy blocks.
+
+    busy must already be merged and sorted, as returned by merge_intervals.
+    """
+    windows = []
+    cursor = window_start
+    for start, end in busy:
+        if end <= cursor:
+            continue
+        if start >= window_end:
+            break
+        if start - cursor >= min_duration:
+            windows.append((cursor, start))
+        cursor = max(cursor, end)
+    if window_end - cursor >= min_duration:
+        windows.append((cursor, window_end))
+    return windows
+
+
+def daily_windows(tz, first_day, days, day_start_hour, day_end_hour, not_before=None):
+    """Working-hour windows, one per day, clipped so nothing starts before not_before."""
+    windows = []
+    for offset in range(days):
+        day = first_day + timedelta(days=offset)
+        start = tz.localize(datetime.combine(day, datetime.min.time()).replace(hour=day_start_hour))
+        end = tz.localize(datetime.combine(day, datetime.min.time()).replace(hour=day_end_hour))
+        if not_before is not None:
+            start = max(start, not_before)
+        if start < end:
+            windows.append((start, end))
+    return windows
@@ -0,0 +1,169 @@
+"""Headless asyncio HTTP/JSON API for the calendar assistant.
+
+One process serves many users: the event loop holds every connection and runs
+each turn on a bounded thread pool, so a turn that waits on Google or OpenAI
+occupies a pool thread and not the loop. Turns in one session run one at a time;
+turns in different sessions run concurrently, even when they belong to the same
+account and share its cached Calendar service: every request that service sends
+borrows its own transport from calendar_client.TransportPool. The Calendar
+client library is synchronous, so the pool is what lets its calls overlap.
+
+    POST   /sessions                  {"credentials": {...}}          -> {"session_id": "..."}
+    POST   /sessions/{id}/messages    {"query": "...", "stream": false} -> {"reply": "..."}
+                                      with "stream": true the reply streams as plain text
+    GET    /sessions/{id}/messages    -> {"messages": [...], "earlier": n}
+    GET    /sessions/{id}/memory      -> bytes held by the session, per key
+    DELETE /sessions/{id}
+    GET    /stats
+
+credentials is the authorized-user info a Google OAuth flow produces (token,
+refresh_token, client_id, client_secret). Session ids are the only access
+control, so run this behind the gateway that authenticates users.
+
+    OPENAI_API_KEY=... python server.py --port 8080
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+from assistant import calendar_service, run_turn
+from event_store import get_event_store
+from llm_cache import get_response_cache
+from session_state import MemorySessionStore, session_memory_bytes, use_session
+from tracing import process_stats
+
+logger = logging.getLogger(__name__)
+
+# Turns running at once across all sessions; each one holds a thread while it waits on the network
+ASSISTANT_WORKERS = int(os.environ.get('ASSISTANT_WORKERS', 64))
+
+
+def run_session_turn(service_factory, session, query, on_chunk=None):
+    # Runs on a pool thread; the session is bound for everything the turn calls
+    service = service_factory(session.credentials)
+    with use_session(session):
+        return run_turn(service, query, on_chunk)
+
+
+def make_app(store=None, service_factory=calendar_service, workers=ASSISTANT_WORKERS):
+    store = store or MemorySessionStore()
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='turn')
+
+    def session_or_404(request):
+        session = store.get(request.match_info['session_id'])
+        if session is None:
+            raise web.HTTPNotFound(text='{"error": "unknown session"}', content_type='application/json')
+        return session
+
+    async def json_body(request):
+        try:
+            body = await request.json()
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            raise web.HTTPBadRequest(text='{"error": "body must be valid JSON"}', content_type='application/json')
+        if not isinstance(body, dict):
+            raise web.HTTPBadRequest(text='{"error": "body must be a JSON object"}', content_type='application/json')
+        return body
+
+    async def create_session(request):
+        body = await json_body(request)
+        credentials = body.get('credentials')
+        if not isinstance(credentials, dict) or not (credentials.get('refresh_token') or credentials.get('token')):
+            raise web.HTTPBadRequest(text='{"error": "credentials with a token or refresh_token are required"}', content_type='application/json')
+        session_id, _ = store.create(credentials=credentials)
+        return web.json_response({'session_id': session_id}, status=201)
+
+    async def post_message(request):
+        session = session_or_404(request)
+        body = await json_body(request)
+        query = body.get('query')
+        if not isinstance(query, str) or not query.strip():
+            raise web.HTTPBadRequest(text='{"error": "query is required"}', content_type='application/json')
+
+        loop = asyncio.get_running_loop()
+        lock = session.setdefault('turn_lock', asyncio.Lock())
+        async with lock:
+            if not body.get('stream'):
+                try:
+                    reply = await loop.run_in_executor(executor, run_session_turn, service_factory, session, query)
+                except Exception as e:
+                    logger.error(f"Error in turn: {str(e)}")
+                    return web.json_response({'error': str(e)}, status=502)
+                return web.json_response({'reply': reply})
+
+            # Chunks cross from the pool thread to the loop through a queue; None marks the end
+            chunks = asyncio.Queue()
+            response = web.StreamResponse(headers={'Content-Type': 'text/plain; charset=utf-8'})
+            await response.prepare(request)
+            future = loop.run_in_executor(
+                executor, run_session_turn, service_factory, session, query,
+                lambda chunk: loop.call_soon_threadsafe(chunks.put_nowait, chunk)
+            )
+            future.add_done_callback(lambda _: chunks.put_nowait(None))
+            try:
+                while (chunk := await chunks.get()) is not None:
+                    await response.write(chunk.encode())
+            finally:
+                # Hold the session lock until the turn has finished, even if the client went away
+                try:
+                    await future
+                except Exception as e:
+                    logger.error(f"Error in streamed turn: {str(e)}")
+            await response.write_eof()
+            return response
+
+    async def get_messages(request):
+        session = session_or_404(request)
+        return web.json_response({'messages': list(session.messages), 'earlier': session.messages.start})
+
+    async def delete_session(request):
+        session = store.get(request.match_info['session_id'])
+        store.delete(request.match_info['session_id'])
+        if session is not None and 'user_id' in session:
+            # Other sessions of the same account rebuild the indexes on their next lookup
+            get_event_store().forget(session.user_id)
+        return web.Response(status=204)
+
+    async def stats(request):
+        return web.json_response({
+            'sessions': len(store),
+            'stages': process_stats.summary(),
+            'llm_cache': get_response_cache().stats(),
+        })
+
+    async def memory(request):
+        session = session_or_404(request)
+        return web.json_response(session_memory_bytes({key: value for key, value in session.items() if key != 'turn_lock'}))
+
+    async def shutdown(app):
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    app = web.Application()
+    app.add_routes([
+        web.post('/sessions', create_session),
+        web.post('/sessions/{session_id}/messages', post_message),
+        web.get('/sessions/{session_id}/messages', get_messages),
+        web.get('/sessions/{session_id}/memory', memory),
+        web.delete('/sessions/{session_id}', delete_session),
+        web.get('/stats', stats),
+    ])
+    app.on_cleanup.append(shutdown)
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Calendar assistant HTTP/JSON API")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=ASSISTANT_WORKERS)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    web.run_app(make_app(workers=args.workers), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
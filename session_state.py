@@ -0,0 +1,269 @@
+"""Per-session state, independent of the UI that owns the session.
+
+The assistant core reads and writes state through current_session(), which is
+st.session_state under Streamlit and a Session from a SessionStore under the
+API server. State is bounded: chat history keeps the last MAX_MESSAGES
+messages in memory and spills older ones to a SQLite file, debug logs go to a
+fixed-size ring buffer, and session_memory_bytes() measures what a session
+holds, so memory per session stays flat however long it runs.
+"""
+import contextvars
+import itertools
+import os
+import sqlite3
+import sys
+import threading
+import time
+import types
+import uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from tracing import session_stats
+
+SESSION_HISTORY_PATH = os.environ.get('SESSION_HISTORY_PATH', 'session_history.sqlite3')
+# Messages kept in memory per session; older ones are only on disk
+MAX_MESSAGES = int(os.environ.get('SESSION_MAX_MESSAGES', 40))
+MAX_LOG_LINES = int(os.environ.get('SESSION_MAX_LOG_LINES', 200))
+# Spilled messages of sessions idle this long are deleted
+SPILL_RETENTION_SECONDS = 7 * 24 * 60 * 60
+# Server-side sessions are dropped after this long without a turn, or beyond MAX_SESSIONS
+SESSION_IDLE_SECONDS = int(os.environ.get('SESSION_IDLE_SECONDS', 60 * 60))
+MAX_SESSIONS = int(os.environ.get('MAX_SESSIONS', 10000))
+
+
+class HistoryStore:
+    def __init__(self, path=SESSION_HISTORY_PATH):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS messages (
+                session_id TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (session_id, position)
+            );
+            CREATE INDEX IF NOT EXISTS messages_by_age ON messages (created_at);
+        """)
+        self.conn.commit()
+
+    def append(self, session_id, position, message):
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO messages (session_id, position, role, content, created_at) VALUES (?, ?, ?, ?, ?)',
+                (session_id, position, message['role'], message['content'], now)
+            )
+            self.conn.execute('DELETE FROM messages WHERE created_at < ?', (now - SPILL_RETENTION_SECONDS,))
+            self.conn.commit()
+
+    def load(self, session_id, start, stop):
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT role, content FROM messages WHERE session_id = ? AND position >= ? AND position < ? ORDER BY position',
+                (session_id, start, stop)
+            ).fetchall()
+        return [{'role': role, 'content': content} for role, content in rows]
+
+    def clear(self, session_id):
+        with self.lock:
+            self.conn.execute('DELETE FROM messages WHERE session_id = ?', (session_id,))
+            self.conn.commit()
+
+
+_history_store = None
+_history_store_lock = threading.Lock()
+
+
+def get_history_store():
+    global _history_store
+    with _history_store_lock:
+        if _history_store is None:
+            _history_store = HistoryStore()
+        return _history_store
+
+
+class MessageHistory:
+    """Append-only chat history holding only the newest max_messages in memory.
+
+    Indexes and slices are absolute positions in the whole conversation, so code
+    that remembers "how far it got" keeps working as old messages are spilled;
+    a slice simply starts at the oldest message still in memory.
+    """
+    __slots__ = ('session_id', 'recent', 'start')
+
+    def __init__(self, max_messages=MAX_MESSAGES):
+        self.session_id = uuid.uuid4().hex
+        self.recent = deque(maxlen=max_messages)
+        # Absolute position of recent[0]; everything before it is on disk
+        self.start = 0
+
+    def append(self, message):
+        if len(self.recent) == self.recent.maxlen:
+            get_history_store().append(self.session_id, self.start, self.recent.popleft())
+            self.start += 1
+        self.recent.append(message)
+
+    def __len__(self):
+        return self.start + len(self.recent)
+
+    def __iter__(self):
+        return iter(self.recent)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, _ = index.indices(len(self))
+            return list(itertools.islice(self.recent, max(start - self.start, 0), max(stop - self.start, 0)))
+        if index < 0:
+            index += len(self)
+        if not self.start <= index < len(self):
+            raise IndexError(f"message {index} is not in memory")
+        return self.recent[index - self.start]
+
+    def older(self, limit=MAX_MESSAGES):
+        """The newest spilled messages, oldest first, read back from disk."""
+        if not self.start:
+            return []
+        return get_history_store().load(self.session_id, max(self.start - limit, 0), self.start)
+
+    def clear(self):
+        if self.start:
+            get_history_store().clear(self.session_id)
+        self.recent.clear()
+        self.start = 0
+
+
+def new_log_buffer(max_lines=MAX_LOG_LINES):
+    return deque(maxlen=max_lines)
+
+
+# Code and modules are shared by every session, not owned by one
+SHARED_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType)
+
+
+def deep_sizeof(value, seen=None):
+    """Approximate bytes held by value and everything it references."""
+    seen = set() if seen is None else seen
+    if id(value) in seen or isinstance(value, SHARED_TYPES):
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(deep_sizeof(key, seen) + deep_sizeof(item, seen) for key, item in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset, deque)):
+        size += sum(deep_sizeof(item, seen) for item in value)
+    elif hasattr(value, '__dict__'):
+        size += deep_sizeof(vars(value), seen)
+    for slot in getattr(type(value), '__slots__', ()):
+        if hasattr(value, slot):
+            size += deep_sizeof(getattr(value, slot), seen)
+    return size
+
+
+def session_memory_bytes(state):
+    """Bytes held by one session's state, per key and in total."""
+    seen = set()
+    sizes = {key: deep_sizeof(value, seen) for key, value in state.items()}
+    sizes['total'] = sum(sizes.values())
+    return sizes
+
+
+class Session(dict):
+    """Session state with attribute access, the same interface the core uses on st.session_state."""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    __setattr__ = dict.__setitem__
+    __delattr__ = dict.__delitem__
+
+
+def init_session(session):
+    # Keys every chat session needs
+    if 'messages' not in session:
+        session.messages = MessageHistory()
+    if 'context' not in session:
+        session.context = {}
+    if 'trace_stats' not in session:
+        session.trace_stats = session_stats()
+
+
+_current_session = contextvars.ContextVar('current_session', default=None)
+
+
+@contextmanager
+def use_session(session):
+    token = _current_session.set(session)
+    try:
+        yield session
+    finally:
+        _current_session.reset(token)
+
+
+def current_session():
+    session = _current_session.get()
+    if session is None:
+        raise RuntimeError("No active session; run the call inside use_session()")
+    return session
+
+
+class MemorySessionStore:
+    """Sessions held in this process, least recently used first."""
+
+    def __init__(self, max_sessions=MAX_SESSIONS, idle_seconds=SESSION_IDLE_SECONDS):
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _evict(self, now):
+        evicted = []
+        while self.sessions:
+            session_id, (last_used, session) = next(iter(self.sessions.items()))
+            if len(self.sessions) <= self.max_sessions and now - last_used < self.idle_seconds:
+                break
+            del self.sessions[session_id]
+            evicted.append(session)
+        return evicted
+
+    def _discard(self, sessions):
+        for session in sessions:
+            if 'messages' in session:
+                session.messages.clear()
+
+    def create(self, **values):
+        session_id = uuid.uuid4().hex
+        session = Session(values)
+        init_session(session)
+        now = time.time()
+        with self.lock:
+            self.sessions[session_id] = (now, session)
+            evicted = self._evict(now)
+        self._discard(evicted)
+        return session_id, session
+
+    def get(self, session_id):
+        now = time.time()
+        with self.lock:
+            evicted = self._evict(now)
+            entry = self.sessions.get(session_id)
+            if entry is not None:
+                self.sessions[session_id] = (now, entry[1])
+                self.sessions.move_to_end(session_id)
+        self._discard(evicted)
+        return entry[1] if entry else None
+
+    def delete(self, session_id):
+        with self.lock:
+            entry = self.sessions.pop(session_id, None)
+        if entry:
+            self._discard([entry[1]])
+
+    def __len__(self):
+        return len(self.sessions)
@@ -0,0 +1,355 @@
+"""Rule-based recognizer for temporal expressions and unambiguous intents.
+
+It runs in front of the LLM dispatcher. If a query is fully accounted for by
+the rules below, it goes straight to the agents. Any query with a word the rules
+cannot explain is left to the model.
+"""
+import re
+from datetime import date, timedelta
+from functools import lru_cache
+
+WEEKDAYS = {
+    'monday': 0, 'mon': 0, 'tuesday': 1, 'tue': 1, 'tues': 1, 'wednesday': 2, 'wed': 2,
+    'thursday': 3, 'thu': 3, 'thur': 3, 'thurs': 3, 'friday': 4, 'fri': 4,
+    'saturday': 5, 'sat': 5, 'sunday': 6, 'sun': 6,
+}
+NUMBER_WORDS = {
+    'a': 1, 'an': 1, 'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5,
+    'six': 6, 'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10,
+}
+
+_WEEKDAY = '|'.join(sorted(WEEKDAYS, key=len, reverse=True))
+_NUMBER = r'\d+(?:\.\d+)?|' + '|'.join(NUMBER_WORDS)
+_MINUTE_UNIT = r'minutes?|mins?|m'
+_HOUR_UNIT = r'hours?|hrs?|h'
+
+CREATE_VERBS = {'add', 'create', 'schedule', 'book', 'set', 'put', 'plan', 'arrange'}
+POLITE_PREFIXES = ('please ', 'pls ', 'can you ', 'could you ', 'would you ', 'i want to ', "i'd like to ", 'id like to ')
+FREE_WORDS = {'free', 'available', 'availability', 'slot', 'slots', 'open', 'gap', 'gaps', 'block', 'blocks', 'window', 'windows'}
+RETRIEVE_WORDS = {'events', 'event', 'schedule', 'calendar', 'agenda', 'plans', 'meetings', 'busy', 'happening', 'on', 'have', 'look', 'looking'}
+QUESTION_WORDS = {'what', 'whats', 'show', 'list', 'any', 'how', 'anything', 'check', 'see', 'tell', 'when', 'find', 'get', 'give'}
+FILLER_WORDS = {
+    'i', 'im', 'me', 'my', 'do', 'does', 'is', 'are', 'am', 'there', 'the', 'a', 'an', 'for', 'of',
+    'in', 'at', 'all', 'it', 'like', 'please', 'pls', 'can', 'you', 'could', 'have', 'got', 'time', 'up',
+}
+ARTICLES = {'a', 'an', 'the'}
+TRAILING_CONNECTORS = {'on', 'at', 'for', 'from', 'to', 'by', 'in'}
+# Titles referring back to an earlier turn ("book it", "add the same thing") need the model, which sees the conversation
+ANAPHORA = {'it', 'its', 'that', 'this', 'these', 'those', 'them', 'they', 'same', 'one', 'ones', 'again', 'another', 'there'}
+CALENDAR_NOUNS = {'calendar', 'diary', 'schedule', 'agenda'}
+# Repeating or several-event requests need the model's weekdays/end_date/events extraction
+RECURRENCE_WORDS = {'every', 'each', 'daily', 'weekly', 'weekday', 'weekdays', 'weekends', 'monthly', 'fortnightly', 'biweekly', 'recurring', 'repeating'}
+# Words that make a question about the calendar as a whole an analytics query, and the report each asks for;
+# 'who' and 'where' only count alongside 'most'
+ANALYTICS_KEYWORDS = {
+    'hours': 'busy_hours', 'busiest': 'busiest_day', 'heatmap': 'heatmap', 'trend': 'trend', 'trends': 'trend',
+    'trending': 'trend', 'stats': 'overview', 'statistics': 'overview', 'analytics': 'overview',
+}
+MOST_METRICS = {'who': 'top_attendees', 'whom': 'top_attendees', 'where': 'top_locations'}
+ANALYTICS_WORDS = {
+    'many', 'much', 'did', 'spend', 'spent', 'which', 'day', 'days', 'week', 'weekday', 'hour', 'most', 'meet',
+    'meeting', 'load', 'was', 'were', 'had', 'been', 'with', 'usually', 'often',
+}
+
+SMALL_TALK = {
+    ('hi', 'hello', 'hey', 'good morning', 'good afternoon', 'good evening'):
+        "Hi! I can create events, show your schedule, find free slots or look up event details.",
+    ('thanks', 'thank you', 'thx', 'ty', 'cheers'): "You're welcome!",
+    ('yes', 'y', 'yeah', 'yep', 'no', 'n', 'nope'): "There's nothing waiting for confirmation right now.",
+}
+
+
+def normalize(text):
+    text = text.lower().replace('\u2019', "'")
+    text = re.sub(r"'s\b", '', text)
+    text = text.replace("'", '')
+    text = re.sub(r'\.(?!\d)', ' ', text)
+    text = re.sub(r'[^\w:\-\. ]', ' ', text)
+    return ' '.join(text.split())
+
+
+def _number(token):
+    return NUMBER_WORDS[token] if token in NUMBER_WORDS else float(token)
+
+
+def _hour(hour, minute, meridiem):
+    hour, minute = int(hour), int(minute or 0)
+    if hour > 23 or minute > 59 or (meridiem and not 1 <= hour <= 12):
+        raise ValueError('not a time')
+    if meridiem == 'pm' and hour != 12:
+        hour += 12
+    elif meridiem == 'am' and hour == 12:
+        hour = 0
+    return hour, minute
+
+
+def _upcoming(today, weekday):
+    return today + timedelta(days=(weekday - today.weekday()) % 7)
+
+
+def _next_monday(today):
+    return today + timedelta(days=7 - today.weekday())
+
+
+def _month_end(day):
+    first_of_next = (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+    return first_of_next - timedelta(days=1)
+
+
+def _quarter(m, today):
+    first = date(today.year, 3 * ((today.month - 1) // 3) + 1, 1)
+    if m.group(1) == 'last':
+        first = date(first.year - 1, 10, 1) if first.month == 1 else date(first.year, first.month - 3, 1)
+    return {'date': first, 'end_date': _month_end(date(first.year, first.month + 2, 1))}
+
+
+def _months_back(day, months):
+    month = day.year * 12 + day.month - 1 - months
+    first = date(month // 12, month % 12 + 1, 1)
+    return first.replace(day=min(day.day, _month_end(first).day))
+
+
+def _past(m, today):
+    amount = int(_number(m.group(1))) if m.group(1) else 1
+    unit = m.group(2)
+    if unit.startswith('year'):
+        start = _months_back(today, 12 * amount)
+    elif unit.startswith('month'):
+        start = _months_back(today, amount)
+    else:
+        start = today - timedelta(days=amount * (7 if unit.startswith('week') else 1))
+    return {'date': start, 'end_date': today}
+
+
+def _duration(m, today):
+    minutes = _number(m.group(1)) * (60 if re.fullmatch(_HOUR_UNIT, m.group(2)) else 1)
+    return {'duration': int(minutes)}
+
+
+def _offset(m, today):
+    amount = _number(m.group(1))
+    unit = m.group(2)
+    if re.fullmatch(_HOUR_UNIT, unit):
+        return {'offset': int(amount * 60)}
+    if re.fullmatch(_MINUTE_UNIT, unit):
+        return {'offset': int(amount)}
+    days = amount * (7 if unit.startswith('week') else 1)
+    return {'date': today + timedelta(days=int(days))}
+
+
+def _time_range(m, today):
+    end = _hour(m.group(4), m.group(5), m.group(6))
+    start_meridiem = m.group(3) or m.group(6)
+    start = _hour(m.group(1), m.group(2), start_meridiem)
+    if not m.group(3) and start > end:
+        # "11-1pm" means 11am to 1pm
+        start = _hour(m.group(1), m.group(2), 'am')
+    minutes = (end[0] * 60 + end[1]) - (start[0] * 60 + start[1])
+    if minutes <= 0:
+        raise ValueError('empty range')
+    return {'time': start, 'duration': minutes}
+
+
+def _bare_hour(m, today):
+    hour = int(m.group(1))
+    if not 1 <= hour <= 12:
+        raise ValueError('not a time')
+    # Without am/pm, small hours are almost always afternoon meetings
+    return {'time': (hour + 12 if hour < 8 else hour, 0)}
+
+
+def _weekday(m, today):
+    day = _upcoming(today, WEEKDAYS[m.group(2)])
+    if m.group(1) == 'next':
+        # "next friday" is the friday of next week, not the coming one
+        day = _next_monday(today) + timedelta(days=WEEKDAYS[m.group(2)])
+    return {'date': day}
+
+
+def _weekend(m, today):
+    saturday = _upcoming(today, 5) if today.weekday() != 6 else today - timedelta(days=1)
+    if m.group(1) == 'next':
+        saturday += timedelta(days=7)
+    return {'date': max(saturday, today), 'end_date': saturday + timedelta(days=1)}
+
+
+# Ordered most specific first; every matched span is removed before the next rule runs.
+RULES = [
+    (r'\b(?:for )?half an hour\b', lambda m, today: {'duration': 30}),
+    (rf'\bfor ({_NUMBER}) ?({_HOUR_UNIT}|{_MINUTE_UNIT})\b', _duration),
+    (rf'\bin ({_NUMBER}) ({_HOUR_UNIT}|{_MINUTE_UNIT}|days?|weeks?)\b', _offset),
+    (rf'\b({_NUMBER})[ -]?({_HOUR_UNIT}|{_MINUTE_UNIT}) (?=slots?\b|blocks?\b|windows?\b|gaps?\b)', _duration),
+    (r'\b(?:from )?(\d{1,2})(?::(\d{2}))? ?(am|pm)? ?(?:-|to|until|till) ?(\d{1,2})(?::(\d{2}))? ?(am|pm)\b', _time_range),
+    (r'\b(?:at )?(\d{1,2})(?::(\d{2}))? ?(am|pm)\b', lambda m, today: {'time': _hour(m.group(1), m.group(2), m.group(3))}),
+    (r'\b(?:at )?(\d{1,2}):(\d{2})\b', lambda m, today: {'time': _hour(m.group(1), m.group(2), None)}),
+    (r'\b(?:at )?(noon|midday|midnight)\b', lambda m, today: {'time': (0, 0) if m.group(1) == 'midnight' else (12, 0)}),
+    (r'\bat (\d{1,2})\b', _bare_hour),
+    (rf'\b(?:the )?next ({_NUMBER}) days\b', lambda m, today: {'date': today, 'end_date': today + timedelta(days=int(_number(m.group(1))) - 1)}),
+    (r'\bnext week\b', lambda m, today: {'date': _next_monday(today), 'end_date': _next_monday(today) + timedelta(days=6)}),
+    (r'\bthis week\b', lambda m, today: {'date': today, 'end_date': _next_monday(today) - timedelta(days=1), 'period_start': today - timedelta(days=today.weekday())}),
+    (r'\b(?:(this|next) )?weekend\b', _weekend),
+    (r'\bnext month\b', lambda m, today: {'date': _month_end(today) + timedelta(days=1), 'end_date': _month_end(_month_end(today) + timedelta(days=1))}),
+    (r'\bthis month\b', lambda m, today: {'date': today, 'end_date': _month_end(today), 'period_start': today.replace(day=1)}),
+    (r'\blast month\b', lambda m, today: {'date': _months_back(today.replace(day=1), 1), 'end_date': today.replace(day=1) - timedelta(days=1)}),
+    (r'\blast week\b', lambda m, today: {'date': today - timedelta(days=today.weekday() + 7), 'end_date': today - timedelta(days=today.weekday() + 1)}),
+    (r'\b(this|last) quarter\b', _quarter),
+    (r'\b(this|last) year\b', lambda m, today: {'date': date(today.year - (m.group(1) == 'last'), 1, 1), 'end_date': date(today.year - (m.group(1) == 'last'), 12, 31)}),
+    (rf'\b(?:over |in )?(?:the )?(?:last|past) (?:({_NUMBER}) )?(days?|weeks?|months?|years?)\b', _past),
+    (r'\b(?:on )?(?:the )?day after (?:tomorrow|tmr|tmrw)\b', lambda m, today: {'date': today + timedelta(days=2)}),
+    (r'\b(?:on )?(?:tomorrow|tmr|tmrw|tomorow)\b', lambda m, today: {'date': today + timedelta(days=1)}),
+    (r'\b(?:on )?(?:today|tonight|this morning|this afternoon|this evening)\b', lambda m, today: {'date': today}),
+    (r'\b(?:on )?yesterday\b', lambda m, today: {'date': today - timedelta(days=1)}),
+    (rf'\b(?:on )?(?:(this|next|coming) )?({_WEEKDAY})\b', _weekday),
+    (r'\b(?:on )?(\d{4}-\d{2}-\d{2})\b', lambda m, today: {'date': date.fromisoformat(m.group(1))}),
+]
+RULES = [(re.compile(pattern), handler) for pattern, handler in RULES]
+
+
+@lru_cache(maxsize=2048)
+def parse_temporal(text, today):
+    """Strip temporal expressions out of normalized text.
+
+    Returns (slots, leftover words), or None when the expressions conflict or do
+    not make sense. Memoized per (text, today), so only pure date arithmetic goes
+    in here. Offsets relative to the current time are resolved by the caller.
+    """
+    slots = {}
+    for pattern, handler in RULES:
+        while True:
+            m = pattern.search(text)
+            if not m:
+                break
+            try:
+                found = handler(m, today)
+            except ValueError:
+                return None
+            if any(key in slots for key in found):
+                return None
+            slots.update(found)
+            text = text[:m.start()] + ' ' + text[m.end():]
+    if 'offset' in slots and ('date' in slots or 'time' in slots):
+        return None
+    return slots, tuple(text.split())
+
+
+def resolve_date(text, today):
+    """Date named by a phrase like 'tomorrow', 'next friday' or 'in 3 days'; None if not recognized."""
+    parsed = parse_temporal(normalize(text), today)
+    if parsed is None:
+        return None
+    slots, leftover = parsed
+    if leftover or 'date' not in slots:
+        return None
+    return slots['date']
+
+
+def search_terms(text, today):
+    """Split a free-form lookup like 'the dentist thing next month' into (temporal slots, search words)."""
+    parsed = parse_temporal(normalize(text), today)
+    if parsed is None:
+        return {}, normalize(text)
+    slots, words = parsed
+    return slots, ' '.join(word for word in words if word not in QUESTION_WORDS | FILLER_WORDS)
+
+
+@lru_cache(maxsize=2048)
+def _recognize(text, today):
+    for phrases, reply in SMALL_TALK.items():
+        if text in phrases:
+            return {'intent': 'small_talk', 'reply': reply}
+
+    for prefix in POLITE_PREFIXES:
+        if text.startswith(prefix):
+            text = text[len(prefix):]
+    parsed = parse_temporal(text, today)
+    if parsed is None:
+        return None
+    slots, words = parsed
+    if not words:
+        return None
+
+    result = {}
+    if 'date' in slots:
+        result['date'] = slots['date'].isoformat()
+    if 'end_date' in slots:
+        result['end_date'] = slots['end_date'].isoformat()
+    if 'time' in slots:
+        result['time'] = '%02d:%02d' % slots['time']
+    if 'duration' in slots:
+        result['duration_minutes'] = slots['duration']
+    if 'offset' in slots:
+        result['offset_minutes'] = slots['offset']
+
+    if words[0] in CREATE_VERBS:
+        counts = {word for word in words if word.isdigit() or word in NUMBER_WORDS} - ARTICLES
+        if RECURRENCE_WORDS & set(words) or counts:
+            return None
+        # Everything that is neither the verb nor a temporal expression is the title
+        title = list(words[2:] if words[0] in ('set', 'put') and words[1:2] in (('up',), ('in',)) else words[1:])
+        while title and title[0] in ARTICLES:
+            title.pop(0)
+        while title:
+            # "put X in my calendar", "set X up"
+            if title[-1] in CALENDAR_NOUNS and len(title) > 1:
+                title = title[:-2] if title[-2] in ('my', 'the') else title[:-1]
+            elif title[-1] in TRAILING_CONNECTORS or (title[-1] == 'up' and words[0] == 'set'):
+                title.pop()
+            else:
+                break
+        if ANAPHORA & set(title) or not set(title) - FILLER_WORDS:
+            return None
+        if 'end_date' in slots or not ('time' in slots or 'offset' in slots):
+            return None
+        result.update(intent='create_event', title=' '.join(title))
+        return result
+
+    if 'time' in slots or 'offset' in slots:
+        return None
+
+    metrics = {ANALYTICS_KEYWORDS[word] for word in words if word in ANALYTICS_KEYWORDS}
+    if 'most' in words:
+        metrics |= {MOST_METRICS[word] for word in words if word in MOST_METRICS}
+    if len(metrics) == 1 and 'duration' not in slots and not FREE_WORDS & set(words):
+        unknown = set(words) - set(ANALYTICS_KEYWORDS) - set(MOST_METRICS) - ANALYTICS_WORDS - RETRIEVE_WORDS - QUESTION_WORDS - FILLER_WORDS
+        if unknown:
+            return None
+        if 'period_start' in slots:
+            # Schedules look ahead from today, but analytics covers the whole week or month
+            result['date'] = slots['period_start'].isoformat()
+        result.update(intent='analyze_events', metric=metrics.pop())
+        return result
+
+    unknown = set(words) - FREE_WORDS - RETRIEVE_WORDS - QUESTION_WORDS - FILLER_WORDS
+    if unknown:
+        return None
+    if FREE_WORDS & set(words):
+        result['intent'] = 'find_free_slots'
+        result.setdefault('date', today.isoformat())
+        return result
+    if 'date' in slots and 'duration' not in slots and (RETRIEVE_WORDS | QUESTION_WORDS) & set(words):
+        result['intent'] = 'retrieve_events'
+        return result
+    return None
+
+
+def recognize_query(text, now):
+    """Dispatch result for queries the rules can classify confidently, else None.
+
+    now must be an aware datetime in the user's zone; it anchors relative days and
+    "in N hours" offsets.
+    """
+    result = _recognize(normalize(text), now.date())
+    if result is None:
+        return None
+    result = dict(result)
+    if result.get('title'):
+        # Recover the user's capitalization from the raw text where possible
+        words = r'\W+'.join(re.escape(word) for word in result['title'].split())
+        m = re.search(words, text, re.IGNORECASE)
+        result['title'] = m.group(0) if m else result['title'].capitalize()
+    offset = result.pop('offset_minutes', None)
+    if offset is not None:
+        when = now + timedelta(minutes=offset)
+        result['date'] = when.strftime('%Y-%m-%d')
+        result['time'] = when.strftime('%H:%M')
+    return result
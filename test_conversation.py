@@ -0,0 +1,17 @@
+from conversation import ConversationContext
+
+
+def message(number):
+    return {'role': 'user' if number % 2 else 'assistant', 'content': f"message {number}"}
+
+
+def test_each_message_is_summarized_once_or_sent_verbatim():
+    conversation = ConversationContext(token_budget=10_000, recent_turns=3)
+    messages = []
+    for number in range(1, 16):
+        messages.append(message(number))
+        prompt = conversation.prompt_context({}, messages)
+        summary = prompt.get('conversation_summary', '').splitlines()
+        assert len(summary) == len(set(summary))
+        assert summary + [f"{m['role']}: {m['content']}" for m in prompt['recent_messages']] == \
+            [f"{m['role']}: {m['content']}" for m in messages]
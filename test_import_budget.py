@@ -0,0 +1,6 @@
+from import_budget import IMPORT_BUDGET_MS, import_problems, measure_import
+
+
+def test_assistant_import_within_budget():
+    elapsed_ms, loaded = measure_import('assistant')
+    assert not import_problems(elapsed_ms, loaded, IMPORT_BUDGET_MS)
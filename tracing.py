@@ -0,0 +1,139 @@
+"""Lightweight per-turn latency tracing.
+
+Wrap each LLM or Google API call in span(stage). Spans opened while a turn()
+is active are attached to that turn. When the turn finishes it goes to the
+per-process StageStats and to each recorder passed to turn(), which is how
+per-session stats are kept. Spans outside any turn go to the process stats
+directly. Stats report p50/p95 per stage and export as JSON lines.
+"""
+import contextvars
+import json
+import math
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from functools import wraps
+
+MAX_SAMPLES_PER_STAGE = 1000
+MAX_RECENT_TURNS = 50
+# Per-session recorders keep a shorter history than the process-wide one
+SESSION_SAMPLES_PER_STAGE = 100
+SESSION_RECENT_TURNS = 5
+
+_current_turn = contextvars.ContextVar('current_turn', default=None)
+
+
+def percentile(sorted_values, fraction):
+    # Nearest-rank percentile
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+
+class Turn:
+    def __init__(self, label=''):
+        self.id = uuid.uuid4().hex[:12]
+        self.label = label
+        self.started_at = time.time()
+        self.duration_ms = None
+        self.spans = []
+
+    def to_records(self):
+        yield {'turn_id': self.id, 'stage': 'turn', 'label': self.label, 'started_at': self.started_at, 'duration_ms': self.duration_ms}
+        for record in self.spans:
+            yield dict(record, turn_id=self.id)
+
+
+class StageStats:
+    def __init__(self, max_samples=MAX_SAMPLES_PER_STAGE, max_turns=MAX_RECENT_TURNS):
+        self.lock = threading.Lock()
+        self.durations = defaultdict(lambda: deque(maxlen=max_samples))
+        self.counts = defaultdict(int)
+        self.tokens = defaultdict(int)
+        self.turns = deque(maxlen=max_turns)
+
+    def add_span(self, record):
+        with self.lock:
+            stage = record['stage']
+            self.durations[stage].append(record['duration_ms'])
+            self.counts[stage] += 1
+            self.tokens[stage] += record.get('prompt_tokens', 0) + record.get('completion_tokens', 0)
+
+    def add_turn(self, turn):
+        for record in turn.spans:
+            self.add_span(record)
+        self.add_span({'stage': 'turn', 'duration_ms': turn.duration_ms})
+        with self.lock:
+            self.turns.append(turn)
+
+    def summary(self):
+        with self.lock:
+            summary = {}
+            for stage, samples in sorted(self.durations.items()):
+                ordered = sorted(samples)
+                summary[stage] = {
+                    'count': self.counts[stage],
+                    'p50_ms': round(percentile(ordered, 0.5), 1),
+                    'p95_ms': round(percentile(ordered, 0.95), 1),
+                    'max_ms': round(ordered[-1], 1) if ordered else 0.0,
+                    'tokens': self.tokens[stage],
+                }
+            return summary
+
+    def export_jsonl(self):
+        with self.lock:
+            turns = list(self.turns)
+        return '\n'.join(json.dumps(record, default=str) for turn in turns for record in turn.to_records())
+
+
+# Spans from every session in this process
+process_stats = StageStats()
+
+
+def session_stats():
+    return StageStats(SESSION_SAMPLES_PER_STAGE, SESSION_RECENT_TURNS)
+
+
+@contextmanager
+def turn(*recorders, label=''):
+    current = Turn(label)
+    token = _current_turn.set(current)
+    start = time.perf_counter()
+    try:
+        yield current
+    finally:
+        current.duration_ms = (time.perf_counter() - start) * 1000
+        _current_turn.reset(token)
+        for recorder in (process_stats, *recorders):
+            recorder.add_turn(current)
+
+
+@contextmanager
+def span(stage, **attrs):
+    record = dict(attrs, stage=stage, started_at=time.time())
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record['error'] = type(e).__name__
+        raise
+    finally:
+        record['duration_ms'] = (time.perf_counter() - start) * 1000
+        current = _current_turn.get()
+        if current is not None:
+            current.spans.append(record)
+        else:
+            process_stats.add_span(record)
+
+
+def traced(stage):
+    """Decorator form of span() for whole functions."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator